@@ -0,0 +1,106 @@
+from pysat.card import CardEnc, EncType, ITotalizer
+
+# encodings of "at most k of n literals", auto picks one by k
+CARD_ENCODINGS = ["auto", "seqcounter", "totalizer", "kmtotalizer", "mtotalizer", "cardnetwrk", "sortnetwrk",
+                  "ladder", "pairwise", "bitwise"]
+# encodings that are extended by new literals, all others are encoded again over all literals
+EXTENSIBLE_ENCODINGS = ("seqcounter", "totalizer")
+# encodings that only support k = 1
+AT_MOST_ONE_ENCODINGS = ("ladder", "pairwise", "bitwise")
+
+
+def choose_encoding(k):
+    # for a few thousand literals, the sequential counter adds the fewest clauses up to k = 3 and the
+    # totalizer with an upper bound of k adds the fewest beyond
+    return "seqcounter" if k <= 3 else "totalizer"
+
+
+def benchmark_encodings(k):
+    return [e for e in CARD_ENCODINGS[1:] if k == 1 or e not in AT_MOST_ONE_ENCODINGS]
+
+
+class AtMostK:
+    """At most k of a list of literals that can grow over time.
+
+    extend() only returns the clauses for the new literals and the new top variable, so the same object can be
+    used for a solver (see Solver.add_at_most_k) and to just count the variables and clauses of an encoding.
+    """
+    def __init__(self, k, encoding):
+        assert (k > 0)
+        if encoding == "auto": encoding = choose_encoding(k)
+        assert (encoding in CARD_ENCODINGS), encoding
+        assert (k == 1 or encoding not in AT_MOST_ONE_ENCODINGS), "%s only supports k = 1" % encoding
+        self.k = k
+        self.encoding = encoding
+        self.lits = []        # all literals that may still be true
+        self.top = 0          # top variable after the last extension
+        self.counter = None   # seqcounter: counter literals after the last literal
+        self.tot = None       # totalizer: ITotalizer over all literals
+        self.num_vars = 0     # variables added so far
+        self.num_clauses = 0  # clauses added so far
+
+    def __del__(self):
+        if self.tot is not None: self.tot.delete()
+
+    def discard(self, xs):
+        # literals fixed to false are left out when encoding again
+        if self.encoding in EXTENSIBLE_ENCODINGS: return
+        xs = set(xs)
+        self.lits = [x for x in self.lits if x not in xs]
+
+    def extend(self, xs, top):
+        if len(xs) == 0: return [], top
+        # when only counting, the variables of previous extensions may be above top
+        top = max(top, self.top)
+        self.lits += xs
+        if self.encoding == "seqcounter":
+            clauses, new_top = self.__seqcounter(xs, top)
+        elif self.encoding == "totalizer":
+            clauses, new_top = self.__totalizer(xs, top)
+        else:
+            cnf = CardEnc.atmost(self.lits, bound=self.k, top_id=top, encoding=getattr(EncType, self.encoding))
+            clauses, new_top = cnf.clauses, max(top, cnf.nv)
+        self.top = new_top
+        self.num_vars += new_top - top
+        self.num_clauses += len(clauses)
+        return clauses, new_top
+
+    # implementation of https://link.springer.com/content/pdf/10.1007%2F11564751_73.pdf
+    # counter[j] is true if at least j + 1 of the literals so far are true, new literals continue the counter
+    def __seqcounter(self, xs, top):
+        k, counter, clauses = self.k, self.counter, []
+        for x in xs:
+            nxt = range(top + 1, top + k + 1)
+            top += k
+            clauses.append([-x, nxt[0]])
+            if counter is None:
+                for j in range(1, k):
+                    clauses.append([-nxt[j]])
+            else:
+                clauses.append([-counter[0], nxt[0]])
+                for j in range(1, k):
+                    clauses.append([-x, -counter[j - 1], nxt[j]])
+                    clauses.append([-counter[j], nxt[j]])
+                clauses.append([-x, -counter[k - 1]])
+            counter = nxt
+        self.counter = counter
+        return clauses, top
+
+    # the new literals are merged into the totalizer tree, whose outputs are limited to k + 1
+    def __totalizer(self, xs, top):
+        if self.tot is None:
+            self.tot = ITotalizer(lits=xs, ubound=self.k, top_id=top)
+        else:
+            self.tot.extend(lits=xs, top_id=top)
+        # only the new clauses are needed
+        clauses, self.tot.cnf.clauses = self.tot.cnf.clauses, []
+        if len(self.tot.rhs) > self.k:
+            clauses.append([-self.tot.rhs[self.k]])
+        return clauses, max(top, self.tot.top_id)
+
+
+def print_benchmark(cards, used):
+    print("| Cardinality  | k: %d | n: %d |" % (used.k, len(used.lits)))
+    for card in cards:
+        print("| %-12s | Vars: %8d | Clauses: %9d |%s" %
+              (card.encoding, card.num_vars, card.num_clauses, " (used)" if card.encoding == used.encoding else ""))
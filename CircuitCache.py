@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import time
+
+from CircuitGraph import CircuitGraph, print_cell_info
+from SafeGraph import SafeGraph
+from Simplifier import Simplifier
+
+CACHE_VERSION = 2
+CACHE_PREFIX = "circuit-"
+CACHE_SUFFIX = ".cache"
+
+
+class Circuit:
+    """Everything verify.py needs from the circuit JSON: the SafeGraph and the net/bit maps of the top module."""
+    def __init__(self, safe_graph, net_bits, bit_info, used_regs, representatives=None, removed_cells=None):
+        self.safe_graph = safe_graph  # SafeGraph
+        self.net_bits = net_bits      # name -> [bits...]
+        self.bit_info = bit_info      # bit -> (name, pos)
+        self.used_regs = used_regs    # [names...]
+        # node removed by the simplification -> representative node
+        self.representatives = representatives if representatives is not None else {}
+        # node removed by the simplification -> its cell
+        self.removed_cells = removed_cells if removed_cells is not None else {}
+        self.merged = {}  # representative node -> [removed nodes...]
+        for n, r in sorted(self.representatives.items()):
+            self.merged.setdefault(r, []).append(n)
+
+
+def cache_key(json_data, top_module, simplify=False):
+    # the cache is addressed by the content of the circuit JSON, the top module and the simplification
+    h = hashlib.sha256()
+    h.update(b"%d\0%s\0%d\0" % (CACHE_VERSION, top_module.encode(), simplify))
+    h.update(json_data)
+    return h.hexdigest()
+
+
+def read_cache(cache_file_path):
+    # returns None if the cache entry does not exist or cannot be read
+    try:
+        with open(cache_file_path, "rb") as f:
+            version, circuit = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError) as e:
+        print("[WARNING] Ignoring unreadable circuit cache %s (%s)" % (cache_file_path, e))
+        return None
+    if version != CACHE_VERSION:
+        return None
+    return circuit
+
+
+def write_cache(cache_file_path, circuit):
+    # write to a temporary file first, so that concurrent runs never see partial entries
+    cache_dir = os.path.dirname(cache_file_path)
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=CACHE_PREFIX, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump((CACHE_VERSION, circuit), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_file_path)
+    except OSError as e:
+        print("[WARNING] Could not write circuit cache %s (%s)" % (cache_file_path, e))
+
+
+def load_circuit(json_file_path, top_module, cache_dir=None, simplify=False):
+    t1 = time.time()
+    with open(json_file_path, "rb") as f:
+        json_data = f.read()
+    cache_file_path = None
+    if cache_dir is not None:
+        cache_file_path = os.path.join(cache_dir, CACHE_PREFIX + cache_key(json_data, top_module, simplify) + CACHE_SUFFIX)
+        circuit = read_cache(cache_file_path)
+        if circuit is not None:
+            print_cell_info(list(circuit.safe_graph.cells.values()) + list(circuit.removed_cells.values()))
+            print("Loaded circuit from cache %s in %.2f" % (cache_file_path, time.time() - t1))
+            return circuit
+
+    circuit_json = json.loads(json_data)
+    circuit_graph = CircuitGraph(circuit_json, top_module)
+    graph, representatives, removed_cells = circuit_graph.graph, None, None
+    if simplify:
+        simplifier = Simplifier(graph)
+        graph, representatives = simplifier.graph, simplifier.representatives
+        removed_cells = {n: circuit_graph.graph.nodes[n]["cell"] for n in representatives}
+    safe_graph = SafeGraph(graph)
+    circuit = Circuit(safe_graph, circuit_graph.net_bits, circuit_graph.bit_info, circuit_graph.used_regs,
+                      representatives, removed_cells)
+    if cache_file_path is not None:
+        write_cache(cache_file_path, circuit)
+    return circuit
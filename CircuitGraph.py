@@ -3,16 +3,29 @@ import networkx as nx
 import helpers
 from defines import *
 from classes import Cell
-import time
 
 CONST_TO_BIT = {"0": 0, "1": 1, "x": -1, "z": -2}
 
 
+def print_cell_info(cells):
+    types = [c.type for c in cells]
+    num_regs = len([t for t in types if t in REGISTER_TYPES])
+    num_lin = len([t for t in types if t in LINEAR_TYPES])
+    num_nonlin = len([t for t in types if t in NONLINEAR_TYPES])
+    num_muxs = len([t for t in types if t == MUX_TYPE])
+    total = len(types)
+    print("| CircuitGraph | Total: %4d | Linear: %4d | Non-linear: %4d | Registers: %4d | Mux: %4d | " %
+          (total, num_lin, num_nonlin, num_regs, num_muxs))
+
+
 class CircuitGraph:
     def __init__(self, circuit_json, top_module):
         self.graph = nx.DiGraph()
         self.circuit_json = circuit_json
         self.top_module = top_module
+        self.net_bits = None   # name -> [bits...]
+        self.bit_info = None   # bit -> (name, pos)
+        self.used_regs = None  # [names...]
         self.parse_json()
         #self.write_graph()
         self.print_graph_info()
@@ -20,7 +33,8 @@ class CircuitGraph:
     def parse_json(self):
         wires = {}  # output -> inputs
         module = self.circuit_json["modules"][self.top_module]
-        net_bits, bit_info, _ = helpers.bit_to_net(module)
+        self.net_bits, self.bit_info, self.used_regs = helpers.bit_to_net(module)
+        bit_info = self.bit_info
         self.graph.clear()
 
         # Add constants, to make things easier
@@ -96,13 +110,7 @@ class CircuitGraph:
         self.graph.add_node(bit, **{"cell": cell})
 
     def print_graph_info(self):
-        num_regs = len([n for n in self.graph.nodes() if self.graph.nodes[n]["cell"].type in REGISTER_TYPES])
-        num_lin = len([n for n in self.graph.nodes() if self.graph.nodes[n]["cell"].type in LINEAR_TYPES])
-        num_nonlin = len([n for n in self.graph.nodes() if self.graph.nodes[n]["cell"].type in NONLINEAR_TYPES])
-        num_muxs = len([n for n in self.graph.nodes() if self.graph.nodes[n]["cell"].type == MUX_TYPE])
-        total = len(list(self.graph.nodes()))
-        print("| CircuitGraph | Total: %4d | Linear: %4d | Non-linear: %4d | Registers: %4d | Mux: %4d | " %
-              (total, num_lin, num_nonlin, num_regs, num_muxs))
+        print_cell_info([self.graph.nodes[n]["cell"] for n in self.graph.nodes()])
 
     def write_graph(self):
         dot = "strict digraph  {\n"
@@ -118,8 +126,3 @@ class CircuitGraph:
         with open(TMP_DIR + "/circuit.dot", "w") as f:
             f.write(dot)
 
-    def write_pickle(self):
-        t1 = time.time()
-        nx.write_gpickle(self.graph, TMP_DIR + "/circuit_graph.gpickle") 
-        t2 = time.time()
-        print("Writing CircuitGraph: %.2f" % (t2-t1))
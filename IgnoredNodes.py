@@ -0,0 +1,46 @@
+import re
+
+
+class IgnoredNodes:
+    """Nodes of a SafeGraph that are forced to be stable and ignored during checks.
+
+    A node is ignored if it drives a net whose name contains one of the patterns, or if all of its
+    predecessors are ignored. The result is a bitmap over the positions of the nodes in the SafeGraph.
+    """
+    def __init__(self, circuit, net_bits, patterns):
+        self.circuit = circuit
+        self.bitmap = bytearray(len(circuit))
+        self.num_matched = 0
+        if len(patterns) == 0: return
+        self.__match(net_bits, patterns)
+        self.__propagate()
+
+    def __match(self, net_bits, patterns):
+        # a single alternation of all patterns, so that every net name is only scanned once
+        regex = re.compile("|".join(map(re.escape, dict.fromkeys(patterns))))
+        for name, bits in net_bits.items():
+            if regex.search(name) is None: continue
+            for b in bits:
+                if type(b) is int and b in self.circuit:
+                    self.bitmap[self.circuit.position(b)] = 1
+        self.num_matched = sum(self.bitmap)
+
+    def __propagate(self):
+        # worklist over the ignored nodes, a node becomes ignored once its last predecessor is ignored,
+        # this also reaches the fixpoint across registers
+        circuit, bitmap = self.circuit, self.bitmap
+        pending = [len(circuit.predecessors(n)) for n in circuit.nodes]
+        stack = [n for n, i in zip(circuit.nodes, bitmap) if i]
+        while len(stack) != 0:
+            for s in circuit.successors(stack.pop()):
+                i = circuit.position(s)
+                pending[i] -= 1
+                if pending[i] != 0 or bitmap[i]: continue
+                bitmap[i] = 1
+                stack.append(s)
+
+    def __contains__(self, n):
+        return n in self.circuit and self.bitmap[self.circuit.position(n)] == 1
+
+    def __len__(self):
+        return sum(self.bitmap)
@@ -0,0 +1,66 @@
+import contextlib
+import io
+import multiprocessing
+import multiprocessing.connection
+import sys
+
+
+def check_worker(worker, jobs, items, check, conn):
+    # the items are sharded round-robin, every worker enumerates all of them and takes every jobs-th one
+    for i, item in enumerate(items):
+        if i % jobs != worker: continue
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            res = check(item)
+        conn.send((i, res, out.getvalue()))
+    conn.send(None)
+
+
+def check_in_parallel(jobs, items, check, num_hits):
+    """Calls check on every item in jobs forked processes and returns the first num_hits results that are not None.
+
+    The processes share everything that is built before with the parent, what check adds to it stays in the
+    process. The output of check is printed in the order of the items, and all processes are killed once the first
+    num_hits hits in that order are known, so the result is the same as for checking the items one after another.
+    """
+    # anything buffered would otherwise be written by the children as well
+    sys.stdout.flush()
+    sys.stderr.flush()
+    ctx = multiprocessing.get_context("fork")
+    procs, conns = [], []
+    for worker in range(jobs):
+        recv, send = ctx.Pipe(duplex=False)
+        p = ctx.Process(target=check_worker, args=(worker, jobs, items, check, send), daemon=True)
+        p.start()
+        send.close()
+        procs.append(p)
+        conns.append(recv)
+
+    hits = []
+    done = {}  # index -> (result, output), for results that arrived ahead of their turn
+    next_i = 0
+    running = list(conns)
+    while len(running) != 0 and len(hits) < num_hits:
+        for conn in multiprocessing.connection.wait(running):
+            try:
+                msg = conn.recv()
+            except EOFError:
+                msg = False
+            assert (msg is not False), "A worker of the parallel checks failed"
+            if msg is None:
+                running.remove(conn)
+                continue
+            i, res, out = msg
+            done[i] = (res, out)
+        while next_i in done and len(hits) < num_hits:
+            res, out = done.pop(next_i)
+            sys.stdout.write(out)
+            if res is not None: hits.append(res)
+            next_i += 1
+    sys.stdout.flush()
+    for p in procs:
+        p.kill()
+        p.join()
+    for conn in conns:
+        conn.close()
+    return hits
@@ -1,65 +1,131 @@
-import networkx as nx
-import pickle 
-import time
+from array import array
+import heapq
 from defines import *
 
-class SafeGraph(nx.DiGraph):
+QUEUE_SPACING = 1 << 64  # initial distance between the labels of queued nodes
+
+
+def topological_order(orig):
+    # Registers, ports and constants are the sources. The remaining nodes are discovered through
+    # the successors of visited nodes and kept in a queue that is processed in passes: a node whose
+    # predecessors (including mux selectors) are all visited is appended to the order and replaced
+    # in the queue by its newly discovered successors, all other nodes wait for the next pass.
+    # Instead of rescanning waiting nodes, the queue is a linked list with ordered integer labels
+    # and nodes are only scheduled (by pass and label) once their last predecessor is visited.
+    order = []
+    for n in orig.nodes():
+        n_type = orig.nodes[n]["cell"].type
+        if (n_type in REGPORT_TYPES) or (n_type == CONST_TYPE):
+            order.append(n)
+    order.sort()
+    sources = set(order)
+    # count the predecessors that are not visited yet
+    pending = {}
+    dependents = {n: [] for n in orig.nodes()}
+    for n in orig.nodes():
+        if n in sources: continue
+        preds = set(orig.predecessors(n))
+        cell = orig.nodes[n]["cell"]
+        if cell.type == MUX_TYPE:
+            preds.add(cell.select)
+        pending[n] = len(preds) - len(preds & sources)
+        for p in preds:
+            if p not in sources: dependents[p].append(n)
+    # initial queue, including muxes whose selector is a source
+    queue = set()
+    for q in order:
+        queue.update(orig.successors(q))
+    queue.update(m for m in orig.nodes() if orig.nodes[m]["cell"].select in sources)
+    queue = sorted(queue.difference(sources))
+    label = {q: i * QUEUE_SPACING for i, q in enumerate(queue)}
+    first_pass = {q: 0 for q in queue}  # first pass in which a node is in the queue
+    head = queue[0] if len(queue) else None
+    nxt = dict(zip(queue, queue[1:]))
+    prv = dict(zip(queue[1:], queue))
+    scheduled = [(0, label[q], q) for q in queue if pending[q] == 0]
+    heapq.heapify(scheduled)
+    while len(scheduled) != 0:
+        p, _, u = heapq.heappop(scheduled)
+        order.append(u)
+        for d in dependents[u]:
+            pending[d] -= 1
+            if pending[d] != 0 or d not in first_pass: continue
+            # nodes behind u in the queue are still visited in this pass
+            same_pass = first_pass[d] <= p and label[d] > label[u]
+            heapq.heappush(scheduled, (p if same_pass else p + 1, label[d], d))
+        new = [s for s in orig.successors(u) if s not in first_pass and s not in sources]
+        after = nxt.get(u)
+        if len(new) != 0:
+            spacing = max(QUEUE_SPACING, len(new))
+            high = label[after] if after is not None else label[u] + spacing
+            if high - label[u] < len(new):
+                # not enough room between the labels, spread them out again
+                n, i = head, 0
+                while n is not None:
+                    label[n] = i * spacing
+                    n, i = nxt.get(n), i + 1
+                scheduled = [(sp, label[n], n) for sp, _, n in scheduled]
+                heapq.heapify(scheduled)
+                high = label[after] if after is not None else label[u] + spacing
+            low = label[u]
+            for i, s in enumerate(new):
+                label[s] = low + i * (high - low) // len(new)
+                first_pass[s] = p + 1
+                if pending[s] == 0:
+                    heapq.heappush(scheduled, (p + 1, label[s], s))
+        # replace u by the new nodes in the queue
+        chain = [prv.pop(u, None)] + new + [nxt.pop(u, None)]
+        if chain[0] is None: head = chain[1]
+        for a, b in zip(chain, chain[1:]):
+            if a is not None: nxt[a] = b
+            if b is not None: prv[b] = a
+    assert(len(orig.nodes()) == len(order)), "Circuit contains combinational loops"
+    return order
+
+
+class SafeGraph:
+    """Read-only, topologically ordered view of a CircuitGraph.
+
+    Nodes keep their CircuitGraph ids, but are renumbered densely by their position in the
+    topological order. Predecessors and successors are stored in CSR form, i.e. the neighbours
+    of the node at position i are the entries offsets[i]:offsets[i + 1] of a flat array.
+    """
     def __init__(self, orig):
-        # initialize graph and get list of initial nodes
-        nx.DiGraph.__init__(self, orig)
-        self._node_list = []
-        for n in orig.nodes():
-            n_type = orig.nodes[n]["cell"].type
-            if (n_type in REGPORT_TYPES) or (n_type == CONST_TYPE):
-                self._node_list.append(n)
-        visited = set(self._node_list)
-        self._node_list.sort()
-        # create a queue for the traversal
-        queue = set()
-        for q in self._node_list:
-            for s in orig.successors(q):
-                queue.add(s)
-        # special handling for muxes
-        queue = queue.union([m for m in orig.nodes() if orig.nodes[m]["cell"].select in visited])
-        queue = sorted(list(queue.difference(visited)))
-        # make a cache of predecessors including mux selectors
-        predecessors = {}
-        for n in orig.nodes():
-            predecessors[n] = list(orig.predecessors(n))
-            cell = orig.nodes[n]["cell"]
-            if cell.type == MUX_TYPE:
-                predecessors[n].append(cell.select)
-        # topological traversal starting from visited nodes
-        q_set = set(queue)
-        while len(queue) != 0:
-            nqueue = []
-            for q in queue:
-                if all(map(lambda p: p in visited, predecessors[q])):
-                    self._node_list.append(q)
-                    visited.add(q)
-                    q_set.remove(q)
-                    for succ in orig.successors(q):
-                        if succ not in q_set and succ not in visited:
-                            nqueue.append(succ)
-                            q_set.add(succ)
-                    continue
-                nqueue.append(q)
-            queue = nqueue
-            assert(len(queue) == len(q_set))
-        assert(len(orig.nodes()) == len(self._node_list))
+        self._node_list = topological_order(orig)
         self._cells = {n: orig.nodes[n]["cell"] for n in self._node_list}
+        self._position = {n: i for i, n in enumerate(self._node_list)}
+        self.__make_adjacency(orig)
+        self.__make_cell_arrays()
 
-    def remove_node(self, n):
-        assert(False), "Cannot remove nodes"
+    def __make_adjacency(self, orig):
+        # edges are visited in the order of their source nodes, like in a copy of orig
+        preds = [[] for _ in self._node_list]
+        succs = [[] for _ in self._node_list]
+        for u, v in orig.edges():
+            preds[self._position[v]].append(u)
+            succs[self._position[u]].append(v)
+        self._pred_offsets, self._preds = SafeGraph.__make_csr(preds)
+        self._succ_offsets, self._succs = SafeGraph.__make_csr(succs)
 
-    def add_node(self, node_for_adding, **attr):
-        assert(False), "Cannot add nodes"
+    @staticmethod
+    def __make_csr(neighbours):
+        offsets = array("I", [0])
+        flat = array("q")
+        for ns in neighbours:
+            flat.extend(ns)
+            offsets.append(len(flat))
+        return offsets, flat
 
-    def remove_edge(self, u, v):
-        assert(False), "Cannot remove edges"
-
-    def add_edge(self, u_of_edge, v_of_edge, **attr):
-        assert(False), "Cannot add edges"
+    def __make_cell_arrays(self):
+        # per position: cell type, position of the mux select and inputs (-1 if none)
+        self._types = bytearray(self._cells[n].type for n in self._node_list)
+        self._selects = array("q", [-1]) * len(self._node_list)
+        self._mux_ins = array("q", [-1, -1]) * len(self._node_list)
+        for i, n in enumerate(self._node_list):
+            cell = self._cells[n]
+            if cell.type != MUX_TYPE: continue
+            self._selects[i] = self._position[cell.select]
+            self._mux_ins[2 * i:2 * i + 2] = array("q", (self._position[m] for m in cell.mux_ins))
 
     @property
     def nodes(self):
@@ -69,9 +135,52 @@ class SafeGraph(nx.DiGraph):
     def cells(self):
         return self._cells
 
-    def write_pickle(self):
-        t1 = time.time()
-        with open(TMP_DIR + "/safe_graph.pickle", 'wb') as f:
-            pickle.dump(self, f)
-        t2 = time.time()
-        print("Writing SafeGraph: %.2f" % (t2-t1))
\ No newline at end of file
+    @property
+    def types(self):
+        return self._types
+
+    @property
+    def selects(self):
+        return self._selects
+
+    @property
+    def mux_ins(self):
+        # the two inputs of the mux at position i are at 2 * i and 2 * i + 1
+        return self._mux_ins
+
+    def __len__(self):
+        return len(self._node_list)
+
+    def __contains__(self, n):
+        return n in self._position
+
+    def position(self, n):
+        return self._position[n]
+
+    def predecessors(self, n):
+        i = self._position[n]
+        return self._preds[self._pred_offsets[i]:self._pred_offsets[i + 1]]
+
+    def successors(self, n):
+        i = self._position[n]
+        return self._succs[self._succ_offsets[i]:self._succ_offsets[i + 1]]
+
+    def fanout(self, roots):
+        # all nodes that transitively depend on one of the roots (including the roots) across registers,
+        # a mux depends on its selector as well
+        position = self._position
+        selected = {}  # selector position -> [mux positions]
+        for i, s in enumerate(self._selects):
+            if s >= 0: selected.setdefault(s, []).append(i)
+        reached = bytearray(len(self._node_list))
+        stack = [position[r] for r in roots]
+        for i in stack: reached[i] = 1
+        while len(stack) != 0:
+            i = stack.pop()
+            succs = [position[s] for s in self._succs[self._succ_offsets[i]:self._succ_offsets[i + 1]]]
+            for j in succs + selected.get(i, []):
+                if reached[j]: continue
+                reached[j] = 1
+                stack.append(j)
+        return [n for n, r in zip(self._node_list, reached) if r]
+
@@ -0,0 +1,228 @@
+import multiprocessing
+import multiprocessing.connection
+import os
+import subprocess
+import sys
+import tempfile
+from dataclasses import dataclass
+import pysat.solvers
+try:
+    import pycryptosat
+except ImportError:
+    pycryptosat = None
+
+# in-process SAT solvers of pysat, the CaDiCaL 1.5.x builds only exist in newer versions of pysat
+PYSAT_SOLVERS = {
+    "cadical": pysat.solvers.Cadical,
+    "glucose3": pysat.solvers.Glucose3,
+    "glucose4": pysat.solvers.Glucose4,
+    "lingeling": pysat.solvers.Lingeling,
+    "maplechrono": pysat.solvers.MapleChrono,
+    "maplecm": pysat.solvers.MapleCM,
+    "maplesat": pysat.solvers.Maplesat,
+    "mergesat3": pysat.solvers.Mergesat3,
+    "minisat22": pysat.solvers.Minisat22,
+    "minisatgh": pysat.solvers.MinisatGH,
+}
+for name, cls in (("cadical103", "Cadical103"), ("cadical153", "Cadical153")):
+    if hasattr(pysat.solvers, cls): PYSAT_SOLVERS[name] = getattr(pysat.solvers, cls)
+# all SAT solvers a Solver can be built on, external runs the binary given by --solver-bin
+SOLVERS = list(PYSAT_SOLVERS) + ["cryptominisat", "external"]
+
+
+def make_backend(name, solver_bin=None):
+    if name in PYSAT_SOLVERS: return PYSAT_SOLVERS[name]()
+    if name == "cryptominisat": return CryptoMiniSat()
+    assert (name == "external"), name
+    return DimacsBinary(solver_bin)
+
+
+class CryptoMiniSat(object):
+    """CryptoMiniSat from the optional pycryptosat package, with the part of the pysat interface that Solver uses.
+
+    XOR constraints are kept in native form and handled by Gauss-Jordan elimination instead of being split into clauses.
+    """
+    native_xor = True
+
+    def __init__(self):
+        assert (pycryptosat is not None), "The cryptominisat solver requires the pycryptosat package"
+        self.cms = pycryptosat.Solver()
+        self.model = None
+        self.num_clauses = 0
+
+    def delete(self):
+        self.cms = None
+
+    def add_clause(self, clause, no_return=True):
+        self.cms.add_clause(clause)
+        self.num_clauses += 1
+
+    def append_formula(self, clauses, no_return=True):
+        self.cms.add_clauses(clauses)
+        self.num_clauses += len(clauses)
+
+    def add_xor_clause(self, lits, rhs=False):
+        # pycryptosat only takes variables: negations flip the parity and duplicate variables cancel out
+        vs = set()
+        for x in lits:
+            vs.symmetric_difference_update((abs(x),))
+            if x < 0: rhs = not rhs
+        assert (len(vs) != 0)
+        self.cms.add_xor_clause(sorted(vs), rhs)
+        self.num_clauses += 1
+
+    def solve(self, assumptions=[]):
+        # variables that are only assumed must be known to CryptoMiniSat
+        top = max(map(abs, assumptions), default=0)
+        if top > self.cms.nb_vars(): self.cms.add_clause([top, -top])
+        res, self.model = self.cms.solve(assumptions)
+        return res
+
+    def get_model(self):
+        if self.model is None: return None
+        return [v if val else -v for v, val in enumerate(self.model) if v != 0]
+
+    def nof_vars(self):
+        return self.cms.nb_vars()
+
+    def nof_clauses(self):
+        return self.num_clauses
+
+
+class DimacsBinary(object):
+    """An external SAT solver binary that reads DIMACS CNF and answers in the SAT competition format.
+
+    The clauses are streamed to a temporary file, every solve call writes them together with the assumptions as unit
+    clauses to a new DIMACS file and runs the binary on it.
+    """
+    def __init__(self, path):
+        assert (path is not None), "The external solver requires --solver-bin"
+        self.path = path
+        # forked processes share the position of this file, so it is only appended to and read with pread
+        self.body = tempfile.TemporaryFile("ab")
+        self.body_size = 0
+        self.num_vars = 0
+        self.num_clauses = 0
+        self.model = None
+
+    def delete(self):
+        if self.body is not None: self.body.close()
+        self.body = None
+
+    def flush(self):
+        self.body.flush()
+
+    def add_clause(self, clause, no_return=True):
+        self.num_vars = max(self.num_vars, max(map(abs, clause), default=0))
+        self.num_clauses += 1
+        line = (" ".join(map(str, clause)) + " 0\n").encode()
+        self.body.write(line)
+        self.body_size += len(line)
+
+    def append_formula(self, clauses, no_return=True):
+        for clause in clauses:
+            self.add_clause(clause)
+
+    def solve(self, assumptions=[]):
+        num_vars = max(self.num_vars, max(map(abs, assumptions), default=0))
+        fd, cnf_path = tempfile.mkstemp(suffix=".cnf")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(b"p cnf %d %d\n" % (num_vars, self.num_clauses + len(assumptions)))
+                self.body.flush()
+                # only the clauses added by this process, even if another one appended more
+                pos = 0
+                while pos < self.body_size:
+                    chunk = os.pread(self.body.fileno(), min(1 << 20, self.body_size - pos), pos)
+                    assert (len(chunk) != 0)
+                    f.write(chunk)
+                    pos += len(chunk)
+                for a in assumptions:
+                    f.write(b"%d 0\n" % a)
+            p = subprocess.run([self.path, cnf_path], capture_output=True, text=True)
+        finally:
+            os.remove(cnf_path)
+        lines = p.stdout.split("\n")
+        status = [l.split()[1:] for l in lines if l.startswith("s ")]
+        res = {10: True, 20: False}.get(p.returncode)
+        if len(status) != 0: res = {"SATISFIABLE": True, "UNSATISFIABLE": False}.get(" ".join(status[0]))
+        assert (res is not None), "Unexpected answer of %s (return code %d)" % (self.path, p.returncode)
+        self.model = None
+        if res:
+            self.model = [int(x) for l in lines if l.startswith("v ") for x in l.split()[1:] if x != "0"]
+        return res
+
+    def get_model(self):
+        return self.model
+
+    def nof_vars(self):
+        return self.num_vars
+
+    def nof_clauses(self):
+        return self.num_clauses
+
+
+@dataclass
+class SolveStats:
+    name: str
+    calls: int = 0
+    sat: int = 0
+    time: float = 0.0
+    max_time: float = 0.0
+
+    def add(self, t, res):
+        self.calls += 1
+        self.sat += res & 1
+        self.time += t
+        self.max_time = max(self.max_time, t)
+
+
+def print_solver_report(stats):
+    for s in stats:
+        print("| %-13s | Calls: %6d | SAT: %6d | Time: %9.2f | Max: %8.2f |" %
+              (s.name, s.calls, s.sat, s.time, s.max_time))
+
+
+def race_worker(sat, assumptions, conn):
+    res = sat.solve(assumptions)
+    conn.send((res, sat.get_model() if res else None))
+
+
+def race(sats, assumptions):
+    """Solves the query with every solver in its own forked process, the first answer wins and the others are killed.
+
+    The forked processes share the formulas that are already built with the parent. Returns the index of the winner,
+    its answer and its model.
+    """
+    # anything buffered would otherwise be written by the children as well
+    sys.stdout.flush()
+    sys.stderr.flush()
+    for sat in sats:
+        if hasattr(sat, "flush"): sat.flush()
+    ctx = multiprocessing.get_context("fork")
+    procs, conns = [], []
+    for sat in sats:
+        recv, send = ctx.Pipe(duplex=False)
+        p = ctx.Process(target=race_worker, args=(sat, assumptions, send), daemon=True)
+        p.start()
+        send.close()
+        procs.append(p)
+        conns.append(recv)
+    winner, result = None, None
+    pending = list(conns)
+    while winner is None and len(pending) != 0:
+        for conn in multiprocessing.connection.wait(pending):
+            pending.remove(conn)
+            try:
+                result = conn.recv()
+            except EOFError:
+                continue  # the solver crashed, wait for the others
+            winner = conns.index(conn)
+            break
+    for p in procs:
+        p.kill()
+        p.join()
+    for conn in conns:
+        conn.close()
+    assert (winner is not None), "All solvers of the portfolio failed"
+    return winner, result[0], result[1]
@@ -1,4 +1,5 @@
 import itertools
+import operator
 
 from defines import *
 from helpers import label_type, parity
@@ -7,31 +8,96 @@ import sys
 import pickle
 import networkx as nx
 from classes import ActiveInfo, VariableInfo, PropVarSet
+from Cardinality import AtMostK, benchmark_encodings, print_benchmark
+from SatBackends import print_solver_report
+from ParallelChecks import check_in_parallel
 from Solver import *
+from VCDStorage import TraceValues, CODE_NONE
 import dbg
 
+# maps value codes such that only the binary ones can compare equal to a value code
+STABLE_CODES = bytes([0, 1] + [254] * 254)
+# maps value codes to 1 if they are non-zero, and if they equal the trigger value 0 or 1
+NONZERO_CODES = bytes([0] + [1] * 255)
+TRIGGER_CODES = {0: bytes([1] + [0] * 255), 1: bytes([0, 1] + [0] * 254)}
+# rules of the stability plan: all inputs stable, any input with the trigger value stable, mux
+STAB_ALL, STAB_TRIGGER, STAB_MUX = range(3)
+# number of probes that are prepared for every round of parallel checks
+PROBE_BATCH = 4096
+
+
+def gather(positions):
+    # returns a function that picks the entries at positions of a sequence, always as a tuple
+    if len(positions) == 1:
+        pos = positions[0]
+        return lambda seq: (seq[pos],)
+    return operator.itemgetter(*positions)
+
+
+def bits_of(codes, table):
+    # one byte 0 or 1 per code, as an integer
+    return int.from_bytes(bytes(codes).translate(table), "little")
+
+
 class Formula:
-    def __init__(self, num_vars):
+    def __init__(self, num_vars, store=False, solver="cadical", solver_bin=None, benchmark=(), portfolio=()):
         self.num_vars = num_vars     # int
         self.node_vars_stable = []   # cycle -> node -> PropVarSet id
         self.node_vars_trans = []    # cycle -> node -> PropVarSet id
         self.node_vars_diff = []     # cycle -> node -> PropVarSet id
         self.prop_var_sets = {}      # id -> PropVarSet
-        self.linear_gate_set = {}    # vars -> (vars...)
-        self.linear_set_cache = {}   # (vars...) -> vars
-        self.nonlin_gate_set = {}    # vars -> (vars...)
-        self.nonlin_set_cache = {}   # (vars...) -> vars
+        self.interned = {}           # PropVarSet content -> vars
+        self.linear_gate_set = {}    # vars -> frozenset(vars...)
+        self.linear_set_cache = {}   # frozenset(vars...) -> vars
+        self.nonlin_gate_set = {}    # vars -> frozenset(vars...)
+        self.nonlin_set_cache = {}   # frozenset(vars...) -> vars
         self.biased_cache = set()    # {vars...}
+        self.biased_memo = {}        # vars -> biased vars, for biased values that are used on their own
+        self.choice_memo = {}        # (vars, vars) -> vars
+        self.mux_memo = {}           # (vars, select vars) -> vars
         self.biased_vars = set()     # {vars...}
         self.check_vars = {}         # labeled node -> prop
         self.assume_act = {}         # labeled node -> prop
         self.covering_top_vars = {}  # vars -> {vars...}
         self.covered_bot_vars = {}   # {vars...}
         self.vars_to_info = {}       # vars -> (cycle, node)
-        self.solver = Solver(store_clauses=True, store_comments=True)
+        # the clauses and comments are only kept in the solver when they are exported
+        self.solver = Solver(store_clauses=store, store_comments=store, solver=solver, solver_bin=solver_bin,
+                             benchmark=benchmark, portfolio=portfolio)
 
         self.dbg_defmap = {}
 
+    def drop_cycles(self, first_cycle, keep):
+        # forget the formulas of all cycles before first_cycle and all PropVarSets that are neither used
+        # by the remaining cycles nor in keep, only the solver keeps their clauses
+        if first_cycle <= 0: return
+        node_vars_lists = (self.node_vars_stable, self.node_vars_trans, self.node_vars_diff)
+        for node_vars in node_vars_lists:
+            for cycle in range(min(first_cycle, len(node_vars))):
+                node_vars[cycle] = {}
+        live = set(keep)
+        for node_vars in node_vars_lists:
+            for vars in node_vars[first_cycle:]:
+                live.update(vars.values())
+        dead = set(self.prop_var_sets).difference(live)
+        if len(dead) == 0: return
+        for table in (self.prop_var_sets, self.linear_gate_set, self.nonlin_gate_set, self.dbg_defmap,
+                      self.vars_to_info, self.covering_top_vars, self.covered_bot_vars):
+            for x in dead: table.pop(x, None)
+        self.biased_cache.difference_update(dead)
+        self.biased_vars.difference_update(dead)
+        # a node is no longer covered once all nodes that covered it are gone
+        for covers in (self.covering_top_vars, self.covered_bot_vars):
+            for x in list(covers):
+                covers[x].difference_update(dead)
+                if len(covers[x]) == 0: del covers[x]
+        for cache in (self.linear_set_cache, self.nonlin_set_cache, self.interned):
+            for k in [k for k, v in cache.items() if v in dead]: del cache[k]
+        for memo in (self.choice_memo, self.mux_memo):
+            for k in [k for k, v in memo.items() if v in dead or not dead.isdisjoint(k)]: del memo[k]
+        for k in [k for k, v in self.biased_memo.items() if k in dead or v in dead]: del self.biased_memo[k]
+        self.solver.forget_xors()
+
     def make_act_assumes(self, shares):
         assume_act = {}
         for ss in sorted(list(shares.keys())):
@@ -81,23 +147,52 @@ class Formula:
             seen += [-act.prop_var for act in fault]
         return result
 
+    def add_prop_var_set(self, pvs):
+        self.prop_var_sets[pvs.id] = pvs
+        self.interned.setdefault(pvs.key(), pvs.id)
+
+    def find_equal(self, pvs):
+        # id of an already defined PropVarSet with the same content, None if there is none
+        return self.interned.get(pvs.key())
+
     def assure_biased(self, vars_id):
         if vars_id in self.biased_cache:
             self.biased_cache.remove(vars_id)
             return vars_id
         biased_vars = PropVarSet(biased=self.prop_var_sets[vars_id], solver=self.solver)
-        self.solver.add_comment("defined %d as biased %d (%s)" %
-                                (biased_vars.id, vars_id, biased_vars))
-        self.prop_var_sets[biased_vars.id] = biased_vars
+        self.solver.add_comment("defined %d as biased %d (%s)", biased_vars.id, vars_id, biased_vars)
+        self.add_prop_var_set(biased_vars)
         self.nonlin_gate_set[biased_vars.id] = self.nonlin_gate_set[vars_id]
-        self.linear_gate_set[biased_vars.id] = (biased_vars.id,)
-        self.nonlin_set_cache[(biased_vars.id,)] = biased_vars.id
-        self.linear_set_cache[(biased_vars.id,)] = biased_vars.id
+        atom = frozenset((biased_vars.id,))
+        self.linear_gate_set[biased_vars.id] = atom
+        self.nonlin_set_cache[atom] = biased_vars.id
+        self.linear_set_cache[atom] = biased_vars.id
         self.dbg_defmap[biased_vars.id] = vars_id
 
         self.add_cover(biased_vars.id, vars_id)
         return biased_vars.id
 
+    def make_biased(self, vars_id):
+        # the same value is biased in the same way, like make_simple does for gates with equal inputs
+        res = self.biased_memo.get(vars_id)
+        if res is None:
+            res = self.assure_biased(vars_id)
+            self.biased_memo[vars_id] = res
+        return res
+
+    def forget_memos(self):
+        # biased values and choices get fresh variables in every cycle, also for operands that keep their id
+        for memo in (self.biased_memo, self.choice_memo, self.mux_memo):
+            memo.clear()
+
+    def make_mux(self, vars_id, select_id):
+        # a mux with an unstable select leaks the biased select on top of the inputs
+        key = (vars_id, select_id)
+        if key not in self.mux_memo:
+            biased_sel = self.assure_biased(select_id)
+            self.mux_memo[key] = self.make_simple(XOR_TYPE, vars_id, biased_sel)
+        return self.mux_memo[key]
+
     def add_cover(self, top, bot):
         if top not in self.covering_top_vars:
             self.covering_top_vars[top] = set()
@@ -111,7 +206,7 @@ class Formula:
         if union is None:
             p1 = self.nonlin_gate_set[param1]
             p2 = self.nonlin_gate_set[param2]
-            union = tuple(sorted(set(p1).union(p2)))
+            union = p1 | p2
         self.nonlin_gate_set[out] = union
         self.nonlin_set_cache[union] = out
 
@@ -120,7 +215,7 @@ class Formula:
         if symdiff is None:
             p1 = self.linear_gate_set[param1]
             p2 = self.linear_gate_set[param2]
-            symdiff = tuple(sorted(set(p1).symmetric_difference(p2)))
+            symdiff = p1 ^ p2
         self.linear_gate_set[out] = symdiff
         self.linear_set_cache[symdiff] = out
 
@@ -135,42 +230,51 @@ class Formula:
         n2 = self.nonlin_gate_set[vars_id2]
 
         if gate_type in LINEAR_TYPES:
-            sd = tuple(sorted(set(l1).symmetric_difference(l2)))
+            sd = l1 ^ l2
             assert(len(sd) != 0)
             cached = self.linear_set_cache.get(sd)
             if cached is not None:
-                self.solver.add_comment("found duplicate xor %s for %s" % (sd, cached))
+                self.solver.add_comment("found duplicate xor %s for %s", sd, cached)
                 return cached
 
             xor_args = tuple(self.prop_var_sets[x] for x in (vars_id1, vars_id2))
             gate_vars = PropVarSet(xor=xor_args, solver=self.solver)
-            self.solver.add_comment("defined %d == %d xor %d" % (gate_vars.id, vars_id1, vars_id2))
+            self.solver.add_comment("defined %d == %d xor %d", gate_vars.id, vars_id1, vars_id2)
 
             self.dbg_defmap[gate_vars.id] = (vars_id1, "xor", vars_id2)
 
-            if len(gate_vars.ones) == 0 and len(gate_vars.vars) == 0: return None
-            self.prop_var_sets[gate_vars.id] = gate_vars
-
-            self.symdiff_gate_set(gate_vars.id, vars_id1, vars_id2, symdiff=sd)
-            self.nonlin_gate_set[gate_vars.id] = (gate_vars.id,)
-            self.nonlin_set_cache[(gate_vars.id,)] = gate_vars.id
+            if gate_vars.is_zero(): return None
             self.biased_cache.discard(vars_id1)
             self.biased_cache.discard(vars_id2)
+            equal = self.find_equal(gate_vars)
+            if equal is not None:
+                # same literals as a set from another path, e.g. in another cycle, the xors of the
+                # literals are shared by the solver, so no variables were allocated for it
+                self.solver.add_comment("found equal xor %d for %d", equal, gate_vars.id)
+                self.linear_set_cache.setdefault(sd, equal)
+                self.biased_cache.discard(equal)
+                return equal
+            self.add_prop_var_set(gate_vars)
+
+            self.symdiff_gate_set(gate_vars.id, vars_id1, vars_id2, symdiff=sd)
+            atom = frozenset((gate_vars.id,))
+            self.nonlin_gate_set[gate_vars.id] = atom
+            self.nonlin_set_cache[atom] = gate_vars.id
         else:  # gate_type in NONLINEAR_TYPES
-            un = tuple(sorted(set(n1).union(n2)))
-            if n1 == un:
+            if n2 <= n1:
                 self.add_cover(vars_id1, vars_id2)
-                self.solver.add_comment("%s is super of %s" % (vars_id1, vars_id2))
+                self.solver.add_comment("%s is super of %s", vars_id1, vars_id2)
                 return vars_id1
-            if n2 == un:
+            if n1 <= n2:
                 self.add_cover(vars_id2, vars_id1)
-                self.solver.add_comment("%s is super of %s" % (vars_id2, vars_id1))
+                self.solver.add_comment("%s is super of %s", vars_id2, vars_id1)
                 return vars_id2
+            un = n1 | n2
             cached = self.nonlin_set_cache.get(un)
             if cached is not None:
                 self.add_cover(cached, vars_id1)
                 self.add_cover(cached, vars_id2)
-                self.solver.add_comment("found duplicate and %s for %s" % (un, cached))
+                self.solver.add_comment("found duplicate and %s for %s", un, cached)
                 return cached
 
             biased_id1 = self.assure_biased(vars_id1)
@@ -178,19 +282,20 @@ class Formula:
 
             xor_args = tuple(self.prop_var_sets[x] for x in (biased_id1, biased_id2))
             gate_vars = PropVarSet(xor=xor_args, solver=self.solver)
-            self.solver.add_comment("defined %d == %d and %d (%d xor %d)"
-                                    % (gate_vars.id, vars_id1, vars_id2, biased_id1, biased_id2))
+            self.solver.add_comment("defined %d == %d and %d (%d xor %d)",
+                                    gate_vars.id, vars_id1, vars_id2, biased_id1, biased_id2)
             
             self.dbg_defmap[gate_vars.id] = (vars_id1, "and", vars_id2)
 
-            if len(gate_vars.ones) == 0 and len(gate_vars.vars) == 0: return None
-            self.prop_var_sets[gate_vars.id] = gate_vars
+            if gate_vars.is_zero(): return None
+            self.add_prop_var_set(gate_vars)
 
             self.union_gate_set(gate_vars.id, vars_id1, vars_id2, union=un)
             self.add_cover(gate_vars.id, vars_id1)
             self.add_cover(gate_vars.id, vars_id2)
-            self.linear_gate_set[gate_vars.id] = (gate_vars.id,)
-            self.linear_set_cache[(gate_vars.id,)] = gate_vars.id
+            atom = frozenset((gate_vars.id,))
+            self.linear_gate_set[gate_vars.id] = atom
+            self.linear_set_cache[atom] = gate_vars.id
 
             self.biased_cache.add(gate_vars.id)
             self.biased_vars.add(gate_vars.id)
@@ -198,15 +303,21 @@ class Formula:
 
     def make_choice(self, arg1, arg2):
         if arg1 == arg2: return arg1
+        # the choice is symmetric, the order of the arguments only selects the phase of the choice variable
+        key = (min(arg1, arg2), max(arg1, arg2))
+        cached = self.choice_memo.get(key)
+        if cached is not None: return cached
         arg_pvs = tuple(self.prop_var_sets[x] for x in (arg1, arg2))
         res = PropVarSet(choice=arg_pvs, solver=self.solver)
-        self.prop_var_sets[res.id] = res
-        self.nonlin_gate_set[res.id] = (res.id,)
-        self.linear_gate_set[res.id] = (res.id,)
-        self.nonlin_set_cache[(res.id,)] = res.id
-        self.linear_set_cache[(res.id,)] = res.id
+        self.add_prop_var_set(res)
+        atom = frozenset((res.id,))
+        self.nonlin_gate_set[res.id] = atom
+        self.linear_gate_set[res.id] = atom
+        self.nonlin_set_cache[atom] = res.id
+        self.linear_set_cache[atom] = res.id
         self.add_cover(res.id, arg1)
         self.add_cover(res.id, arg2)
+        self.choice_memo[key] = res.id
         return res.id
 
     def collect_active_time_constrained(self, mode, hamming, glitch_behavior, cycle, ignored):
@@ -263,7 +374,7 @@ class Formula:
 
     def model_for_vars(self, model, vars_id):
         props = self.prop_var_sets[vars_id]
-        l = tuple(((x in model) & 1) if type(x) == int else int(x) for x in props.tuple())
+        l = tuple(1 if x == PROP_ONE else ((x in model) & 1) for x in props.tuple())
         return l
 
     def __backtrack_fault(self, model, location, mode):
@@ -299,6 +410,11 @@ class SatChecker(object):
         assert(args.mode in (TRANSIENT, STABLE))
 
         self.circuit = safe_graph
+        # resolve the trace signal of every cell once
+        self.handles = {n: trace.resolve(c.name, c.pos) for n, c in safe_graph.cells.items()}
+        self.node_handles = [self.handles[n] for n in safe_graph.nodes]
+        self.values = TraceValues(trace, self.node_handles)
+        self.stability_plan = self.__make_stability_plan()
 
         assert(args.probing_model != CLASSIC or args.cycles != UINT_MAX)
         self.labels = labels
@@ -331,11 +447,28 @@ class SatChecker(object):
         self.ignored = ignored
         self.dbg_exact_formula = args.dbg_exact_formula
         self.checking_mode = args.checking_mode
+        self.window = args.window
+        self.jobs = args.jobs
         self.__extract_label_info(labels)
         self.num_vars = len(self.variables) + (self.cycles * len(self.volatile_randoms))
         assert (self.num_vars == len(self.pretty_names))
-
-        self.formula = Formula(self.num_vars)
+        # only nodes that depend on a labeled variable get a formula, all others just provide trace values
+        self.cone = self.circuit.fanout(self.variables + self.volatile_randoms)
+        print("Cone of influence: %d of %d nodes" % (len(self.cone), len(self.circuit.nodes)))
+        # per cone node: whether it is ignored
+        self.cone_ignored = bytes(ignored.bitmap[self.circuit.position(n)] for n in self.cone)
+
+        self.formula = Formula(self.num_vars, store=self.export_cnf, solver=args.solver, solver_bin=args.solver_bin,
+                               benchmark=args.solver_benchmark, portfolio=args.portfolio)
+        self.solver_report = args.solver_report or len(args.solver_benchmark) != 0
+        # per-secret check network, extended from cycle to cycle
+        self.check_acts = {}       # vars -> activation prop of the probe
+        self.check_card = AtMostK(self.order, args.card_encoding)
+        # the same cardinality constraint in all other encodings, only to count their variables and clauses
+        self.card_benchmark = []
+        if args.card_benchmark:
+            self.card_benchmark = [AtMostK(self.order, e) for e in benchmark_encodings(self.order)]
+        self.check_false = None    # prop that is always false, for empty parities
 
     def __extract_label_info(self, labels):
         for label_id in labels.keys():
@@ -364,13 +497,17 @@ class SatChecker(object):
             for idx, r in enumerate(self.volatile_randoms):
                 self.var_indexes[(r, i)] = len(self.variables) + i * len(self.volatile_randoms) + idx
 
+    def __value(self, node_id):
+        handle = self.handles[node_id]
+        assert handle, "Signal %s not found in VCD file" % self.circuit.cells[node_id].name
+        return self.trace.get_value(handle)
+
     # @profile
     def __simple_inherit(self, type_, preds, curr_vars, info):
         nvars = None
         for p0, p1 in zip(preds, reversed(preds)):
             if p0 not in curr_vars.keys(): continue
-            p1c = self.circuit.cells[p1]
-            value = self.trace.get_signal_value(p1c.name, p1c.pos)
+            value = self.__value(p1)
             stable = (info is None) or info[p1]
             if value == TRIGGERS[type_] and stable: continue
             nvars = curr_vars[p0]
@@ -379,11 +516,11 @@ class SatChecker(object):
     # @profile
     def __proc_simple(self, gate, type_, curr_vars, info=None):
         assert(type_ in GATE_TYPES)
-        preds = tuple(self.circuit.predecessors(gate))
+        preds = self.circuit.predecessors(gate)
         if all(map(lambda p: p in curr_vars.keys(), preds)):
             if curr_vars[preds[0]] == curr_vars[preds[1]]:
                 return None if (type_ in LINEAR_TYPES) else curr_vars[preds[0]]
-            self.formula.solver.add_comment("Definition for %d %s:" % (gate, self.circuit.cells[gate]))
+            self.formula.solver.add_comment("Definition for %d %s:", gate, self.circuit.cells[gate])
             return self.formula.make_simple(type_, curr_vars[preds[0]], curr_vars[preds[1]])
         # take the actual type here
         type_ = self.circuit.cells[gate].type
@@ -408,8 +545,7 @@ class SatChecker(object):
         assert(len(mux_ins) == 2)
         if select not in curr_vars.keys():
             if sel_stable:
-                sel_cell = self.circuit.cells[select]
-                value = self.trace.get_signal_value(sel_cell.name, sel_cell.pos)
+                value = self.__value(select)
                 assert(value in BIN_STR), "invalid select value is '%s'" % value
                 return curr_vars.get(mux_ins[int(value)])
             else:
@@ -417,8 +553,7 @@ class SatChecker(object):
             assert(False)
         res_vars = self.__make_mux_sel_not_stable(mode, mux_ins, curr_vars)
         if res_vars is None: return curr_vars[select]
-        biased_sel = self.formula.assure_biased(curr_vars[select])
-        return self.formula.make_simple(XOR_TYPE, res_vars, biased_sel)
+        return self.formula.make_mux(res_vars, curr_vars[select])
 
     def __build_node_stable(self, node_id, curr_vars, prev_vars):
         cell = self.circuit.cells[node_id]
@@ -428,7 +563,7 @@ class SatChecker(object):
         elif cell.type == NOT_TYPE or cell.type in REGISTER_TYPES:
             if cell.type in REGISTER_TYPES and node_id in curr_vars: return None
             target_vars = curr_vars if cell.type == NOT_TYPE else prev_vars
-            pred0 = self.circuit.predecessors(node_id).__next__()
+            pred0 = self.circuit.predecessors(node_id)[0]
             nvars = target_vars.get(pred0)
         elif cell.type == PORT_TYPE:
             return None
@@ -443,7 +578,7 @@ class SatChecker(object):
         if len(self.formula.node_vars_stable) > 1:
             prev_vars = self.formula.node_vars_stable[-2]
 
-        for node_id in self.circuit.nodes:
+        for node_id in self.cone:
             nvars = self.__build_node_stable(node_id, curr_vars, prev_vars)
             if nvars is not None: curr_vars[node_id] = nvars
         pass
@@ -455,7 +590,7 @@ class SatChecker(object):
         valid = [(reg in x) for x in (prev.keys(), curr.keys())]
         if all(valid):
             if prev[reg] == curr[reg]: return prev[reg]
-            self.formula.solver.add_comment("Definition for trans %d %s" % (reg, self.circuit.cells[reg]))
+            self.formula.solver.add_comment("Definition for trans %d %s", reg, self.circuit.cells[reg])
             if self.glitch_behavior == LOOSE:
                 return self.formula.make_choice(prev[reg], curr[reg])
             else:
@@ -463,52 +598,98 @@ class SatChecker(object):
         elif not any(valid): return None
 
         signal = prev[reg] if (reg in prev) else curr[reg]
-        biased = self.formula.assure_biased(signal)
-        return biased
+        return self.formula.make_biased(signal)
 
     @staticmethod
     def get_blocking(nodes, stability, stable_nodes):
         return {p: (p not in stable_nodes and stability[p])
                 for p in nodes}
 
+    def __make_stability_plan(self):
+        # the nodes whose stability depends on their predecessors are grouped by topological level, rule and
+        # number of predecessors, every group is stored contiguously in the layout and updated at once
+        circuit = self.circuit
+        level = [0] * len(circuit.nodes)
+        groups = {}  # (level, rule, trigger, number of predecessors) -> [(position, predecessor positions)]
+        for i, node_id in enumerate(circuit.nodes):
+            type_ = circuit.types[i]
+            if not (type_ in GATE_TYPES or type_ in (NOT_TYPE, MUX_TYPE)): continue
+            preds = tuple(map(circuit.position, circuit.predecessors(node_id)))
+            level[i] = 1 + max((level[p] for p in preds), default=0)
+            trigger = TRIGGERS.get(type_)
+            if type_ == MUX_TYPE:
+                preds = (circuit.selects[i], circuit.mux_ins[2 * i], circuit.mux_ins[2 * i + 1]) + preds
+                key = (level[i], STAB_MUX, None, len(preds))
+            elif trigger is not None:
+                key = (level[i], STAB_TRIGGER, int(trigger), len(preds))
+            else:
+                key = (level[i], STAB_ALL, None, len(preds))
+            groups.setdefault(key, []).append((i, preds))
+        # nodes that keep their initial stability come first
+        layout = [i for i in range(len(circuit.nodes)) if level[i] == 0]
+        for key in sorted(groups):
+            layout += [i for i, _ in groups[key]]
+        where = [0] * len(layout)
+        for j, i in enumerate(layout):
+            where[i] = j
+        plan = []
+        for key in sorted(groups):
+            _, rule, trigger, num_preds = key
+            members = groups[key]
+            first = where[members[0][0]]
+            # stability of the k-th predecessors from the layout, values of the k-th predecessors from the node order
+            stab = [gather([where[preds[k]] for _, preds in members]) for k in range(num_preds)]
+            vals = [gather([preds[k] for _, preds in members]) for k in range(num_preds)]
+            plan.append((first, first + len(members), rule, trigger, stab, vals, gather([i for i, _ in members])))
+        return gather(layout), [circuit.nodes[i] for i in layout], plan
+
     # @profile
     def __make_stability_info(self):
-        stability = {}  # node -> bool
-        for node_id in self.circuit.nodes:
-            cell = self.circuit.cells[node_id]
-            prev_val = self.trace.get_signal_value(cell.name, cell.pos, True)
-            curr_val = self.trace.get_signal_value(cell.name, cell.pos, False)
-            stability[node_id] = prev_val in BIN_STR and (prev_val == curr_val)
-            if not stability[node_id]: continue
-            if cell.type in REGPORT_TYPES: continue
-            preds = self.circuit.predecessors(node_id)
-            # XOR, XNOR, NOT gates are stable if all inputs are stable
-            # same goes for AND with value 1 and OR with value 0
-            if cell.type in LINEAR_TYPES or cell.type == NOT_TYPE or (
-               cell.type in NONLINEAR_TYPES and curr_val != TRIGGERS[cell.type]):
-                stability[node_id] &= all([stability[p] for p in preds])
-            # if AND is 0, it is stable if any input that is 0 is stable
-            # if OR is 1, it is stable if any input that is 1 is stable
-            elif cell.type in NONLINEAR_TYPES and curr_val == TRIGGERS[cell.type]:
-                stability[node_id] = False
-                for p in preds:
-                    c = self.circuit.cells[p]
-                    if self.trace.get_signal_value(c.name, c.pos) == TRIGGERS[cell.type]:
-                        stability[node_id] |= stability[p]
-            elif cell.type == MUX_TYPE:
-                if stability[cell.select]:
-                    # if SELECT is stable, inherit the selected inputs stability
-                    sel_cell = self.circuit.cells[cell.select]
-                    sel_val = int(self.trace.get_signal_value(sel_cell.name, sel_cell.pos))
-                    stability[node_id] &= stability[cell.mux_ins[sel_val]]
+        """Returns for every node whether its value is stable from the previous to the current cycle.
+
+        Nodes start as stable if they have the same binary value in both cycles, then the stability is propagated
+        in topological order. The value bytes of each group of the stability plan are handled as one integer, so
+        all nodes of a group are updated by a few operations on the whole group.
+        """
+        self.values.update()
+        prev_vals, curr_vals = self.values.prev, self.values.curr
+        missing = curr_vals.find(CODE_NONE)
+        assert(missing < 0), "Signal %s not found in VCD file" % self.circuit.cells[self.circuit.nodes[missing]].name
+        # a node is stable if it has the same binary value as in the previous cycle,
+        # non-binary previous values are mapped to a code that never matches
+        to_layout, layout_nodes, plan = self.stability_plan
+        stability = bytearray(to_layout(bytes(map(operator.eq, prev_vals.translate(STABLE_CODES), curr_vals))))
+        for first, last, rule, trigger, stab, vals, own_vals in plan:
+            num = last - first
+            ones = int.from_bytes(b"\1" * num, "little")
+            res = int.from_bytes(stability[first:last], "little")
+            preds = [int.from_bytes(bytes(g(stability)), "little") for g in stab]
+            if rule == STAB_MUX:
+                select, in0, in1 = preds[:3]
+                # if SELECT is stable, inherit the selected inputs stability
+                high = bits_of(vals[0](curr_vals), NONZERO_CODES)
+                chosen = (high & in1) | ((high ^ ones) & in0)
+                # if SELECT is not stable, then both inputs must be stable and equal
+                both = int.from_bytes(bytes(map(operator.eq, vals[1](curr_vals), vals[2](curr_vals))), "little")
+                for x in preds[3:]: both &= x
+                res &= (select & chosen) | ((select ^ ones) & both)
+            else:
+                all_stable = ones
+                for x in preds: all_stable &= x
+                if rule == STAB_TRIGGER:
+                    # if AND is 0, it is stable if any input that is 0 is stable
+                    # if OR is 1, it is stable if any input that is 1 is stable
+                    table = TRIGGER_CODES[trigger]
+                    any_stable = 0
+                    for x, v in zip(preds, vals): any_stable |= x & bits_of(v(curr_vals), table)
+                    hit = bits_of(own_vals(curr_vals), table)
+                    res &= (hit & any_stable) | ((hit ^ ones) & all_stable)
                 else:
-                    # if SELECT is not stable, then both inputs must be stable and equal
-                    stability[node_id] &= all([stability[p] for p in preds])
-                    if stability[node_id]:
-                        in_cells = [self.circuit.cells[x] for x in cell.mux_ins]
-                        vals = [self.trace.get_signal_value(c.name, c.pos) for c in in_cells]
-                        stability[node_id] &= (vals[0] == vals[1])
-        return stability
+                    # XOR, XNOR, NOT gates are stable if all inputs are stable
+                    # same goes for AND with value 1 and OR with value 0
+                    res &= all_stable
+            stability[first:last] = res.to_bytes(num, "little")
+        return dict(zip(layout_nodes, stability))
 
     # @profile
     def __build_trans(self):
@@ -519,8 +700,8 @@ class SatChecker(object):
         curr_vars = self.formula.node_vars_trans[-1]
         all_stable_nodes = set(curr_stable.keys()).union(prev_stable.keys())
         stability = self.__make_stability_info()
-        for node_id in self.circuit.nodes:
-            if node_id in self.ignored:
+        for node_id, is_ignored in zip(self.cone, self.cone_ignored):
+            if is_ignored:
                 if node_id in curr_stable: curr_vars[node_id] = curr_stable[node_id]
                 continue
 
@@ -533,7 +714,7 @@ class SatChecker(object):
                 type_ = cell.type if (self.glitch_behavior == LOOSE) else AND_TYPE
                 nvars = self.__proc_simple(node_id, type_, curr_vars, info)
             elif cell.type == NOT_TYPE:
-                pred0 = preds.__next__()
+                pred0 = preds[0]
                 nvars = curr_vars.get(pred0)
             elif cell.type in REGISTER_TYPES:
                 nvars = self.__proc_trans_reg(node_id, prev_stable, curr_stable)
@@ -547,17 +728,19 @@ class SatChecker(object):
 
     def __init_propvarset(self, var_idx, var):
         gate_vars = PropVarSet(num=self.num_vars)
-        gate_vars.ones.add(var_idx)
-        self.formula.prop_var_sets[gate_vars.id] = gate_vars
-        self.formula.nonlin_gate_set[gate_vars.id] = (gate_vars.id,)
-        self.formula.linear_gate_set[gate_vars.id] = (gate_vars.id,)
-        self.formula.nonlin_set_cache[(gate_vars.id,)] = gate_vars.id
-        self.formula.linear_set_cache[(gate_vars.id,)] = gate_vars.id
+        gate_vars.ones |= 1 << var_idx
+        self.formula.add_prop_var_set(gate_vars)
+        atom = frozenset((gate_vars.id,))
+        self.formula.nonlin_gate_set[gate_vars.id] = atom
+        self.formula.linear_gate_set[gate_vars.id] = atom
+        self.formula.nonlin_set_cache[atom] = gate_vars.id
+        self.formula.linear_set_cache[atom] = gate_vars.id
         assert (self.circuit.cells[var].type in REGPORT_TYPES)
         self.formula.node_vars_stable[-1][var] = gate_vars.id
         self.formula.node_vars_trans[-1][var] = gate_vars.id
 
     def __init_cycle(self, cycle):
+        self.formula.forget_memos()
         self.formula.node_vars_stable.append({})
         self.formula.node_vars_trans.append({})
         self.formula.node_vars_diff.append({})
@@ -651,9 +834,10 @@ class SatChecker(object):
             cycle += 1
         self.cycles = cycle
 
-    def __get_assumes_per_secret(self, ss, assume_act):
+    def __get_assumes_per_secret(self, ss, assume_act, mask_act):
         assumes = [self.formula.check_vars[share] for share in self.shares[ss]]
         assumes += [assume_act[ss_] for ss_ in self.shares if ss != ss_]
+        assumes.append(mask_act)
         return assumes
 
     def __dbg_compute_cone(self, location, preds, last):
@@ -798,9 +982,9 @@ class SatChecker(object):
             # print(ss, self.shares[ss], [self.var_indexes[s] for s in self.shares[ss]])
             vs = {pvs[self.var_indexes[s]] for s in self.shares[ss]}
             # print(pvs, vs)
-            found_0 = "0" in vs
-            found_1 = "1" in vs
-            vs = {v for v in vs if type(v) != str}
+            found_0 = PROP_ZERO in vs
+            found_1 = PROP_ONE in vs
+            vs = vs.difference((PROP_ZERO, PROP_ONE))
             if found_0 and found_1:
                 trivial = True
                 break
@@ -864,9 +1048,14 @@ class SatChecker(object):
 
 
     def __check_tuple(self, all_ids, masks):
+        probe = self.__prepare_probe(all_ids, masks)
+        if probe is None: return None
+        return self.__solve_probe(probe)
+
+    def __prepare_probe(self, all_ids, masks):
+        # builds everything the probe needs in the formula, returns None if the probe is trivially secure
         var_infos = [self.formula.vars_to_info[vid] for vid in all_ids]
         if all(map(lambda x: x.cycle < self.from_cycle, var_infos)): return None
-        probe_time = time.time()
 
         pvs_id = all_ids[0]
         for pvs_id_ in all_ids[1:]:
@@ -876,8 +1065,8 @@ class SatChecker(object):
         pvs = self.formula.prop_var_sets[pvs_id]
         mask_assumes = {pvs[self.var_indexes[m]] for m in masks}
         # trivial case, a mask is always active
-        if "1" in mask_assumes: return None
-        mask_assumes = [-x for x in mask_assumes if type(x) != str]
+        if PROP_ONE in mask_assumes: return None
+        mask_assumes = [-x for x in mask_assumes if x != PROP_ZERO]
 
         act_assumes, positive = self.__get_assumes_per_location(pvs)
         # trivial case, no complete secrets
@@ -900,9 +1089,12 @@ class SatChecker(object):
             if self.kissat_bin_path:
                 self.kissat_dbg_map["_".join(set(str(ai.cell_id) for ai in var_infos))] = var_infos
                 return None
+        return (assumes, positive, var_infos, "Checking probe %s: " % "; ".join(fmt_list))
 
+    def __solve_probe(self, probe):
+        assumes, positive, var_infos, out_fmt = probe
+        probe_time = time.time()
         sys.stdout.flush()
-        out_fmt = "Checking probe %s: " % "; ".join(fmt_list)
         for ip, p in enumerate(positive):
             assumes.append(p)
             r = self.formula.solver.solve(assumes)
@@ -930,8 +1122,6 @@ class SatChecker(object):
         return self.static_randoms + cycle_volatile_randoms
 
     def __check_secure_classic(self):
-        leaks = []
-        
         #DEBUG
         if self.dbg_exact_formula:
             self.dbgLabelsStable = dbg.DbgLabels(self.dbg_output_dir_path + "/dbgLabelsStable")
@@ -939,26 +1129,57 @@ class SatChecker(object):
         self.__build_formula()
         active = self.formula.collect_active_classic(self.mode)
         all_masks = self.__collect_masks(self.cycles)
-        for probe_i, vars_ids in enumerate(itertools.combinations(active, self.order)):
-            all_ids = tuple(set(sum(vars_ids, tuple())))
-            leak = self.__check_tuple(all_ids, all_masks)
-            if leak is None: continue
-            leaks.append(leak)
-            if len(leaks) >= self.num_leaks: break
+        tuples = (tuple(set(sum(vars_ids, tuple()))) for vars_ids in itertools.combinations(active, self.order))
+        return self.__check_tuples(tuples, all_masks, self.num_leaks)
+
+    def __check_tuples(self, tuples, masks, num_leaks):
+        # returns the leaks of the first num_leaks tuples that leak
+        leaks = []
+        if self.jobs == 1:
+            for all_ids in tuples:
+                leak = self.__check_tuple(all_ids, masks)
+                if leak is None: continue
+                leaks.append(leak)
+                if len(leaks) >= num_leaks: break
+            return leaks
+        # preparing a probe changes the formula for later probes and cycles, so that is done here in order
+        # and only the solving is done by the worker processes. The batches grow up to PROBE_BATCH, so that
+        # the probes prepared in vain after the last leak are at most as many as the probes checked before
+        tuples = iter(tuples)
+        batch_size = self.jobs
+        while len(leaks) < num_leaks:
+            batch = list(itertools.islice(tuples, batch_size))
+            if len(batch) == 0: break
+            batch_size = min(2 * batch_size, PROBE_BATCH)
+            probes = [p for p in (self.__prepare_probe(all_ids, masks) for all_ids in batch) if p is not None]
+            if len(probes) == 0: continue
+            self.formula.solver.flush()
+            leaks += check_in_parallel(self.jobs, probes, self.__solve_probe, num_leaks - len(leaks))
         return leaks
 
 
     def __make_checks(self, active):
+        # the network of the previous cycles is extended in place: only the new probes are added to the
+        # cardinality constraint and the parities, probes that are no longer active are disabled for good
+        disabled = [self.check_acts.pop(key) for key in list(self.check_acts) if key not in active]
+        for act in disabled:
+            self.formula.solver.add_clause([-act])
         # keys is just used to keep the order consistent
-        keys = list(active.keys())
+        keys = [key for key in active.keys() if key not in self.check_acts]
         act_vars = [active[key].prop_var for key in keys]
-        self.formula.solver.at_most_k_of_n(self.order, act_vars)
+        self.check_acts.update(zip(keys, act_vars))
+        self.check_card.discard(disabled)
+        self.formula.solver.add_at_most_k(self.check_card, act_vars)
+        for card in self.card_benchmark:
+            card.discard(disabled)
+            card.extend(act_vars, self.formula.solver.top_var())
         for var_name, var_idx in self.var_indexes.items():
-            ands = []
+            prev = self.formula.check_vars.get(var_name)
+            ands = [] if prev in (None, self.check_false) else [prev]
             for kid, key in enumerate(keys):
                 prp = self.formula.prop_var_sets[key][var_idx]
-                if prp == "0": pass
-                elif prp == "1": ands.append(act_vars[kid])
+                if prp == PROP_ZERO: pass
+                elif prp == PROP_ONE: ands.append(act_vars[kid])
                 else:
                     c = self.formula.solver.get_var()
                     self.formula.solver.add_clauses(
@@ -966,9 +1187,10 @@ class SatChecker(object):
                     ands.append(c)
             if len(ands) == 0:
                 print("Empty xor for variable index ", var_name)
-                x = self.formula.solver.get_var()
-                self.formula.solver.add_clause([-x])
-                self.formula.check_vars[var_name] = x
+                if self.check_false is None:
+                    self.check_false = self.formula.solver.get_var()
+                    self.formula.solver.add_clause([-self.check_false])
+                self.formula.check_vars[var_name] = self.check_false
             else:
                 self.formula.check_vars[var_name] = self.formula.solver.xor_list(ands)
         
@@ -1009,14 +1231,18 @@ class SatChecker(object):
                         self.formula.vars_to_info[vars[node]] = VariableInfo(cycle, node)
                         if vars[node] in active.keys(): continue
                         if vars[node] in self.formula.covered_bot_vars: continue
-                        active[vars[node]] = ActiveInfo(cycle, node, self.formula.solver.get_var())
+                        act = self.check_acts.get(vars[node])
+                        if act is None: act = self.formula.solver.get_var()
+                        active[vars[node]] = ActiveInfo(cycle, node, act)
 
                 self.__make_checks(active)
                 assume_act = self.formula.make_act_assumes(self.shares)
-                self.formula.solver.add_clauses([[-self.formula.check_vars[m]] for m in all_masks])
+                # the parities of the masks only have to cancel out in the current cycle
+                mask_act = self.formula.solver.get_var()
+                self.formula.solver.add_clauses([[-mask_act, -self.formula.check_vars[m]] for m in all_masks])
                 check_fmt = "Checking secret %%%dd %%s: " % len(str(len(self.shares)))
                 for ss in sorted(list(self.shares.keys())):
-                    assumes = self.__get_assumes_per_secret(ss, assume_act)
+                    assumes = self.__get_assumes_per_secret(ss, assume_act, mask_act)
                     print(check_fmt % (ss, assumes[:self.order + 1]))
                     r = self.formula.solver.solve(assumes)
                     if not r: continue
@@ -1029,15 +1255,17 @@ class SatChecker(object):
                 # ...
                 # need to check comb(prev_active, 1) + comb(curr_active, ord)
                 # need to check comb(prev_active, 0) + comb(curr_active, ord)
-                for prev_ord in range(0, self.order):
-                    curr_ord = self.order - prev_ord
-                    for probe_prev_i, prev_vars_ids in enumerate(itertools.combinations(prev_active, prev_ord)):
-                        for probe_curr_i, curr_vars_ids in enumerate(itertools.combinations(curr_active, curr_ord)):
-                            all_ids = tuple(set(sum(prev_vars_ids + curr_vars_ids, tuple())))
-                            leak = self.__check_tuple(all_ids, all_masks)
-                            if leak is None: continue
-                            leaks.append(leak)
-                            if len(leaks) >= self.num_leaks: return leaks
+                tuples = (tuple(set(sum(prev_vars_ids + curr_vars_ids, tuple())))
+                          for prev_ord in range(0, self.order)
+                          for prev_vars_ids in itertools.combinations(prev_active, prev_ord)
+                          for curr_vars_ids in itertools.combinations(curr_active, self.order - prev_ord))
+                leaks += self.__check_tuples(tuples, all_masks, self.num_leaks - len(leaks))
+                if len(leaks) >= self.num_leaks: return leaks
+            # found leaks are reported with all the cycles they depend on
+            if self.window is not None and len(leaks) == 0:
+                first_cycle = cycle + 1 - self.window
+                prev_active[:] = [a for a in prev_active if self.formula.vars_to_info[a[0]].cycle >= first_cycle]
+                self.formula.drop_cycles(first_cycle, [a[0] for a in prev_active + curr_active])
             cycle += 1
         return leaks
 
@@ -1049,6 +1277,10 @@ class SatChecker(object):
         else:
             leaks = self.__check_secure_time_constrained()
         print("Finished in %.2f" % (time.time() - start_time))
+        if len(self.card_benchmark) != 0:
+            print_benchmark(self.card_benchmark, self.check_card)
+        if self.solver_report:
+            print_solver_report(self.formula.solver.stats)
         self.__debug_leaks(leaks)
         return len(leaks) == 0, leaks
 
@@ -0,0 +1,126 @@
+import dataclasses
+import networkx as nx
+from defines import *
+from SafeGraph import topological_order
+
+# node ids of the constant cells, see CircuitGraph.CONST_TO_BIT
+CONST_0, CONST_1 = 0, 1
+# (gate type, constant input) -> result: None for the other input, a constant, or NOT of the other input
+CONST_RULES = {
+    (AND_TYPE, CONST_0): CONST_0, (AND_TYPE, CONST_1): None,
+    (OR_TYPE, CONST_0): None, (OR_TYPE, CONST_1): CONST_1,
+    (XOR_TYPE, CONST_0): None, (XOR_TYPE, CONST_1): NOT_TYPE,
+    (XNOR_TYPE, CONST_0): NOT_TYPE, (XNOR_TYPE, CONST_1): None,
+}
+# gates with two identical inputs
+SAME_INPUT_RULES = {AND_TYPE: None, OR_TYPE: None, XOR_TYPE: CONST_0, XNOR_TYPE: CONST_1}
+INVERTED = {XOR_TYPE: XNOR_TYPE, XNOR_TYPE: XOR_TYPE}
+
+
+class Simplifier:
+    """Structural hashing, constant propagation and inverter folding on a CircuitGraph.
+
+    Every rewrite preserves the value of each remaining cell, so that the trace values of the cells stay
+    valid: a removed cell always has the same value as its representative, and a rewritten cell computes
+    the same function from other cells (e.g. NOT(XNOR(a, b)) becomes XOR(a, b)). Registers, ports and
+    constants are never removed.
+    """
+    def __init__(self, graph):
+        self.orig = graph
+        self.representatives = {}  # removed node -> representative node
+        self.cells = {}            # node -> (possibly rewritten) cell
+        self.preds = {}            # node -> [predecessors...]
+        self.hashes = {}           # structural key -> node
+        self.graph = nx.DiGraph()
+        self.simplify()
+
+    def rep(self, n):
+        while n in self.representatives:
+            n = self.representatives[n]
+        return n
+
+    def __remove(self, n, representative):
+        self.representatives[n] = representative
+        del self.cells[n]
+        del self.preds[n]
+
+    def __rewrite(self, n):
+        # returns the representative if n can be removed, None otherwise
+        cell = self.cells[n]
+        preds = self.preds[n]
+        if cell.type == MUX_TYPE:
+            if cell.select in (CONST_0, CONST_1):
+                return cell.mux_ins[cell.select]
+            return None
+        if cell.type == NOT_TYPE:
+            p = preds[0]
+            if p in (CONST_0, CONST_1):
+                return CONST_1 - p
+            p_cell = self.cells[p]
+            if p_cell.type == NOT_TYPE:
+                return self.preds[p][0]
+            if p_cell.type in INVERTED:
+                # NOT(XNOR(a, b)) == XOR(a, b) and vice versa
+                self.cells[n] = dataclasses.replace(cell, type=INVERTED[p_cell.type])
+                self.preds[n] = list(self.preds[p])
+                return self.__rewrite(n)
+            return None
+        if cell.type in GATE_TYPES:
+            if len(preds) == 1:
+                return SAME_INPUT_RULES[cell.type] if SAME_INPUT_RULES[cell.type] is not None else preds[0]
+            for i, p in enumerate(preds):
+                if (cell.type, p) not in CONST_RULES: continue
+                other = preds[1 - i]
+                res = CONST_RULES[(cell.type, p)]
+                if res is None: return other
+                if res != NOT_TYPE: return res
+                self.cells[n] = dataclasses.replace(cell, type=NOT_TYPE)
+                self.preds[n] = [other]
+                return self.__rewrite(n)
+        return None
+
+    def __key(self, n):
+        cell = self.cells[n]
+        if cell.type in GATE_TYPES:
+            return (cell.type,) + tuple(sorted(self.preds[n]))
+        if cell.type == NOT_TYPE:
+            return (cell.type, self.preds[n][0])
+        if cell.type == MUX_TYPE:
+            return (cell.type, cell.select) + tuple(cell.mux_ins)
+        return None
+
+    def simplify(self):
+        order = topological_order(self.orig)
+        for n in order:
+            self.cells[n] = self.orig.nodes[n]["cell"]
+            self.preds[n] = list(self.orig.predecessors(n))
+        for n in order:
+            cell = self.cells[n]
+            if cell.type in REGPORT_TYPES or cell.type == CONST_TYPE: continue
+            # the predecessors are final already, apart from the inputs of registers
+            preds = []
+            for p in map(self.rep, self.preds[n]):
+                if p not in preds: preds.append(p)
+            self.preds[n] = preds
+            if cell.type == MUX_TYPE:
+                self.cells[n] = dataclasses.replace(cell, select=self.rep(cell.select),
+                                                    mux_ins=[self.rep(m) for m in cell.mux_ins])
+            representative = self.__rewrite(n)
+            if representative is None:
+                key = self.__key(n)
+                representative = self.hashes.setdefault(key, n) if key is not None else n
+            if representative != n:
+                self.__remove(n, representative)
+        # registers may depend on nodes that were removed after them
+        for n in order:
+            if n in self.cells and self.cells[n].type in REGISTER_TYPES:
+                self.preds[n] = [self.rep(p) for p in self.preds[n]]
+        self.representatives = {n: self.rep(n) for n in self.representatives}
+
+        for n in self.orig.nodes():
+            if n in self.cells:
+                self.graph.add_node(n, cell=self.cells[n])
+        for n in self.graph.nodes():
+            for p in self.preds[n]:
+                self.graph.add_edge(p, n)
+        print("| Simplifier   | Removed: %4d | Remaining: %4d |" % (len(self.representatives), len(self.cells)))
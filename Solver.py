@@ -1,21 +1,64 @@
-from pysat.solvers import Cadical
+import time
+from Cardinality import AtMostK
 from defines import LIST_XOR
+from SatBackends import make_backend, race, SolveStats
 import helpers
 
 
-class Solver(Cadical):
-    def __init__(self, store_clauses=False, store_comments=False):
-        Cadical.__init__(self)
+class Solver(object):
+    def __init__(self, store_clauses=False, store_comments=False, solver="cadical", solver_bin=None, benchmark=(),
+                 portfolio=()):
+        assert (len(benchmark) == 0 or len(portfolio) == 0)
+        self.sat = make_backend(solver, solver_bin)
+        # solvers that get the same clauses and queries, either to compare their performance or to race
+        self.others = [make_backend(name, solver_bin) for name in list(benchmark) + list(portfolio)]
+        self.stats = [SolveStats(name) for name in [solver] + list(benchmark) + list(portfolio)]
+        self.portfolio = len(portfolio) != 0
+        self.model = None  # model of the winner of the last race
+        # XORs are only kept in native form if all solvers can handle them
+        self.native_xor = all(getattr(sat, "native_xor", False) for sat in [self.sat] + self.others)
         self.__var = 1
         self.clock_act = None
         self.__dbg_clauses = []
         self.__dbg_comments = {}
         self.num_clauses = 0
+        self.xor_memo = {}  # (var, var) -> var, for xors of two literals
         self.store_clauses = store_clauses
         self.store_comments = store_comments
 
     def __del__(self):
-        self.delete()
+        for sat in [self.sat] + self.others:
+            sat.delete()
+
+    def solve(self, assumptions=[]):
+        if self.portfolio:
+            t = time.time()
+            winner, res, self.model = race([self.sat] + self.others, assumptions)
+            self.stats[winner].add(time.time() - t, res)
+            return res
+        res = None
+        for sat, stats in zip([self.sat] + self.others, self.stats):
+            t = time.time()
+            r = sat.solve(assumptions)
+            stats.add(time.time() - t, r)
+            if res is None: res = r
+            assert (r == res), "%s and %s disagree" % (self.stats[0].name, stats.name)
+        return res
+
+    def flush(self):
+        # clauses that a backend buffers must be written before forking
+        for sat in [self.sat] + self.others:
+            if hasattr(sat, "flush"): sat.flush()
+
+    def get_model(self):
+        if self.portfolio: return self.model
+        return self.sat.get_model()
+
+    def nof_vars(self):
+        return self.sat.nof_vars()
+
+    def nof_clauses(self):
+        return self.sat.nof_clauses()
 
     def dbg_print(self):
         if self.store_clauses:
@@ -61,27 +104,67 @@ class Solver(Cadical):
     def get_var(self):
         return self.get_vars_(1)
 
-    def add_comment(self, text):
-        if self.num_clauses not in self.__dbg_comments.keys():
-            self.__dbg_comments[self.num_clauses] = []
-        self.__dbg_comments[self.num_clauses].append(text)
+    def top_var(self):
+        return self.__var - 1
+
+    def add_comment(self, fmt, *args):
+        # the comment is only formatted if it is stored
+        if not self.store_comments: return
+        self.__dbg_comments.setdefault(self.num_clauses, []).append(fmt % args)
 
     # @profile
     def add_clause(self, clause, no_return=True):
-        assert(max(map(abs, clause)) < self.__var)
         if self.store_clauses:
+            assert(max(map(abs, clause)) < self.__var)
             self.__dbg_clauses.append(clause)
         self.num_clauses += 1
-        cl = clause.copy()
-        if self.clock_act is not None: cl.append(-self.clock_act)
-        Cadical.add_clause(self, cl, no_return)
+        if self.clock_act is not None: clause = clause + [-self.clock_act]
+        self.sat.add_clause(clause, no_return)
+        for sat in self.others:
+            sat.add_clause(clause)
 
     def add_clauses(self, clauses):
-        for clause in clauses:
-            self.add_clause(clause)
+        if self.store_clauses or self.clock_act is not None:
+            for clause in clauses:
+                self.add_clause(clause)
+            return
+        # without stored clauses, the whole batch goes to the solvers at once
+        self.num_clauses += len(clauses)
+        for sat in [self.sat] + self.others:
+            sat.append_formula(clauses)
+
+    # res is the xor of lits, as a single constraint if the SAT solver handles XOR natively
+    def add_xor(self, lits, res):
+        if not self.native_xor:
+            self.add_clauses(make_xor_bool(lits[0], lits[1], res) if len(lits) == 2 else make_xor_bool_exp(lits, res))
+            return
+        assert (not self.store_clauses and self.clock_act is None)
+        self.num_clauses += 1
+        for sat in [self.sat] + self.others:
+            sat.add_xor_clause(list(lits) + [res])
+
+    def make_xor(self, a, b):
+        # xors of the same two variables share their result, negated inputs only negate it
+        key = (min(abs(a), abs(b)), max(abs(a), abs(b)))
+        assert (key[0] != key[1])
+        res = self.xor_memo.get(key)
+        if res is None:
+            res = self.get_var()
+            self.add_xor(list(key), res)
+            self.xor_memo[key] = res
+        return -res if (a < 0) != (b < 0) else res
+
+    def forget_xors(self):
+        # the clauses stay in the solver, only later xors no longer share their results with earlier ones
+        self.xor_memo.clear()
 
     def xor_list(self, lst):
         assert(len(lst) >= 1)
+        if self.native_xor:
+            if len(lst) == 1: return lst[0]
+            res = self.get_var()
+            self.add_xor(lst, res)
+            return res
         assert (LIST_XOR in ("shallow", "tree", "chain"))
         if LIST_XOR == "shallow":
             # xor shallow
@@ -137,29 +220,17 @@ class Solver(Cadical):
         self.add_clauses(res)
         return out
 
-    # implementation of https://link.springer.com/content/pdf/10.1007%2F11564751_73.pdf
-    def at_most_k_of_n(self, k, xs):
+    def at_most_k_of_n(self, k, xs, encoding="seqcounter"):
         assert (k > 0)
-        n = len(xs)
-        if k >= n: return
-        clauses = []
-        # tmp = self.get_vars(k * n)
-        ss = [self.get_vars(k) for i in range(n)]
-        # ss = [list(range(tmp + i * k, tmp + (i + 1) * k)) for i in range(n)]
-        clauses.append([-xs[0], ss[0][0]])
-        for j in range(1, k):
-            clauses.append([-ss[0][j]])
-        for i in range(1, n - 1):
-            clauses.append([-xs[i], ss[i][0]])
-            clauses.append([-ss[i - 1][0], ss[i][0]])
-            for j in range(1, k):
-                clauses.append([-xs[i], -ss[i - 1][j - 1], ss[i][j]])
-                clauses.append([-ss[i - 1][j], ss[i][j]])
-            clauses.append([-xs[i], -ss[i - 1][k - 1]])
-        clauses.append([-xs[n - 1], -ss[n - 2][k - 1]])
-        self.add_comment("at most %d of %s" % (k, xs))
+        if k >= len(xs): return
+        self.add_at_most_k(AtMostK(k, encoding), xs)
+
+    # extends the cardinality constraint card by the literals xs
+    def add_at_most_k(self, card, xs):
+        clauses, top = card.extend(xs, self.__var - 1)
+        self.get_vars_(top - self.__var + 1)
+        self.add_comment("at most %d of %s (%s)", card.k, xs, card.encoding)
         self.add_clauses(clauses)
-        # print("Choose k of n literals:", xs, "\n", clauses)
 
 
 def make_xor_bool_exp(lst, res):
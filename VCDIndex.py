@@ -0,0 +1,251 @@
+from array import array
+from bisect import bisect_right
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+INDEX_MAGIC = b"ALMAVCDX"
+INDEX_VERSION = 3
+INDEX_SUFFIX = ".idx"
+# magic, version, header length
+HEADER_FMT = "<8sQQ"
+
+
+def source_stamp(vcd_file_path):
+    st = os.stat(vcd_file_path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def write_index(index_file_path, data):
+    # other runs may have the old index mapped, so it is replaced instead of being written in place
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(index_file_path)),
+                                    prefix=os.path.basename(index_file_path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, index_file_path)
+    except OSError:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+        raise
+
+
+def align8(num):
+    return (num + 7) & ~7
+
+
+def num_bytes(width):
+    return (width + 7) >> 3
+
+
+class VCDIndexWriter:
+    """Collects the value changes of a VCD trace and serializes them into the columnar index layout.
+
+    The index consists of a JSON header followed by four aligned sections:
+    * for every signal, the (sorted) list of cycles in which it changes
+    * for every signal, the values it takes on at those cycles as packed little endian integers,
+      followed by the x and z masks if the signal is ever x or z
+    * for every cycle, the offset into the list of changed signals
+    * the list of changed signals, grouped by cycle
+    """
+    def __init__(self, name_to_id, id_to_width, ids=None):
+        # ids: vcd_ids of the signals to store, None for all
+        self.name_to_id = name_to_id
+        self.id_to_width = id_to_width
+        self.complete = ids is None
+        self.ids = sorted(id_to_width.keys() if ids is None else ids)
+        self.id_to_sig = {vcd_id: sig for sig, vcd_id in enumerate(self.ids)}
+        self.change_cycles = [array("I") for _ in self.ids]  # signal -> [cycles...]
+        self.change_values = [bytearray() for _ in self.ids]  # signal -> packed values
+        self.change_xmasks = [bytearray() for _ in self.ids]  # signal -> packed x masks
+        self.change_zmasks = [bytearray() for _ in self.ids]  # signal -> packed z masks
+        self.has_xz = [False for _ in self.ids]                # signal -> any x or z value stored
+        self.sig_bytes = [num_bytes(id_to_width[vcd_id]) for vcd_id in self.ids]
+        self.cycle_offsets = array("Q", [0])                   # cycle -> offset in cycle_changes
+        self.cycle_changes = array("I")                        # [signals...]
+        self.last_values = {}                                  # vcd_id -> last stored value
+
+    def add_cycle(self, values):
+        # values: vcd_id -> new (bits, xmask, zmask) of all signals that (potentially) changed in this cycle
+        cycle = len(self.cycle_offsets) - 1
+        changed = []
+        last_values = self.last_values
+        id_to_sig = self.id_to_sig
+        sig_bytes = self.sig_bytes
+        has_xz = self.has_xz
+        for vcd_id, value in values.items():
+            if last_values.get(vcd_id) == value: continue
+            last_values[vcd_id] = value
+            sig = id_to_sig[vcd_id]
+            self.change_cycles[sig].append(cycle)
+            nbytes = sig_bytes[sig]
+            bits, xmask, zmask = value
+            if (xmask | zmask) and not has_xz[sig]:
+                # masks are only stored for signals that are ever x or z
+                has_xz[sig] = True
+                self.change_xmasks[sig] = bytearray(len(self.change_values[sig]))
+                self.change_zmasks[sig] = bytearray(len(self.change_values[sig]))
+            self.change_values[sig] += bits.to_bytes(nbytes, "little")
+            if has_xz[sig]:
+                self.change_xmasks[sig] += xmask.to_bytes(nbytes, "little")
+                self.change_zmasks[sig] += zmask.to_bytes(nbytes, "little")
+            changed.append(sig)
+        changed.sort()
+        self.cycle_changes.extend(changed)
+        self.cycle_offsets.append(len(self.cycle_changes))
+
+    def serialize(self, num_cycles, timestamps, source):
+        signals = {}
+        cycles_size, values_size = 0, 0
+        for sig, vcd_id in enumerate(self.ids):
+            num = len(self.change_cycles[sig])
+            signals[vcd_id] = [self.id_to_width[vcd_id], cycles_size, values_size, num, self.has_xz[sig]]
+            cycles_size += num * self.change_cycles[sig].itemsize
+            values_size += len(self.change_values[sig]) * (3 if self.has_xz[sig] else 1)
+        header = {
+            "source": source,
+            "byteorder": sys.byteorder,
+            "num_cycles": num_cycles,
+            "timestamps": timestamps,
+            "names": self.name_to_id,
+            "ids": self.ids,
+            "complete": self.complete,
+            "signals": signals,
+            "cycles_size": cycles_size,
+            "values_size": values_size,
+            "offsets_size": len(self.cycle_offsets) * self.cycle_offsets.itemsize,
+        }
+        header = json.dumps(header).encode()
+        header += b" " * (align8(len(header)) - len(header))
+        data = bytearray(struct.pack(HEADER_FMT, INDEX_MAGIC, INDEX_VERSION, len(header)))
+        data += header
+        for part in self.change_cycles:
+            data += part.tobytes()
+        data += b"\0" * (align8(len(data)) - len(data))
+        for sig in range(len(self.ids)):
+            data += self.change_values[sig]
+            if self.has_xz[sig]:
+                data += self.change_xmasks[sig]
+                data += self.change_zmasks[sig]
+        data += b"\0" * (align8(len(data)) - len(data))
+        data += self.cycle_offsets.tobytes()
+        data += self.cycle_changes.tobytes()
+        return bytes(data)
+
+
+class VCDIndex:
+    """Read-only view of a serialized trace index, memory-mapped when loaded from disk."""
+    def __init__(self, data, header, start):
+        self.data = data
+        self.source = header["source"]
+        self.num_cycles = header["num_cycles"]
+        self.timestamps = header["timestamps"]
+        self.all_names = header["names"]
+        self.ids = header["ids"]
+        self.complete = header["complete"]
+        self.id_to_sig = {vcd_id: sig for sig, vcd_id in enumerate(self.ids)}
+        # only expose the names of signals that are stored
+        self.name_to_id = {n: i for n, i in self.all_names.items() if i in self.id_to_sig}
+        self.id_to_width = {vcd_id: header["signals"][vcd_id][0] for vcd_id in self.ids}
+
+        # a damaged or partially written index raises a ValueError, every section must fit the header and the file
+        def check(cond):
+            if not cond: raise ValueError("damaged index")
+        cycles_size, values_size, offsets_size = header["cycles_size"], header["values_size"], header["offsets_size"]
+        check(min(cycles_size, values_size, offsets_size) >= 0 and offsets_size % 8 == 0 and offsets_size != 0)
+        view = memoryview(data)
+        cycles_start = start
+        values_start = cycles_start + align8(cycles_size)
+        offsets_start = values_start + align8(values_size)
+        changes_start = offsets_start + offsets_size
+        check(changes_start <= len(data) and (len(data) - changes_start) % 4 == 0)
+        self.cycle_offsets = view[offsets_start:changes_start].cast("Q")
+        self.cycle_changes = view[changes_start:].cast("I")
+        check(self.cycle_offsets[0] == 0 and self.cycle_offsets[-1] == len(self.cycle_changes))
+        check(len(self.cycle_offsets) >= self.num_cycles + 1)
+        self.sig_bytes = []
+        self.sig_cycles = []
+        self.sig_values = []
+        self.sig_xmasks = []  # None if the signal is never x or z
+        self.sig_zmasks = []
+        for vcd_id in self.ids:
+            width, cycles_off, values_off, num, has_xz = header["signals"][vcd_id]
+            nbytes = num_bytes(width)
+            size = nbytes * num
+            check(min(cycles_off, values_off, num) >= 0 and cycles_off % 4 == 0)
+            check(cycles_off + 4 * num <= cycles_size and values_off + size * (3 if has_xz else 1) <= values_size)
+            cycles_off += cycles_start
+            values_off += values_start
+            self.sig_bytes.append(nbytes)
+            self.sig_cycles.append(view[cycles_off:cycles_off + 4 * num].cast("I"))
+            self.sig_values.append(view[values_off:values_off + size])
+            if has_xz:
+                self.sig_xmasks.append(view[values_off + size:values_off + 2 * size])
+                self.sig_zmasks.append(view[values_off + 2 * size:values_off + 3 * size])
+            else:
+                self.sig_xmasks.append(None)
+                self.sig_zmasks.append(None)
+
+    @staticmethod
+    def from_bytes(data):
+        magic, version, header_len = struct.unpack_from(HEADER_FMT, data)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            return None
+        start = struct.calcsize(HEADER_FMT)
+        if start + header_len > len(data):
+            return None
+        header = json.loads(bytes(data[start:start + header_len]).decode())
+        if header["byteorder"] != sys.byteorder:
+            return None
+        return VCDIndex(data, header, start + header_len)
+
+    @staticmethod
+    def load(index_file_path, vcd_file_path):
+        # returns None if the index does not exist or is outdated
+        if not os.path.isfile(index_file_path):
+            return None
+        with open(index_file_path, "rb") as f:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                return None
+        index = None
+        try:
+            index = VCDIndex.from_bytes(data)
+        except (struct.error, ValueError, KeyError, TypeError):
+            pass
+        if index is None or index.source != source_stamp(vcd_file_path):
+            return None
+        return index
+
+    def covers(self, ids):
+        # check whether all signals with the given vcd_ids (None for all) are stored
+        if self.complete: return True
+        return ids is not None and all(map(lambda x: x in self.id_to_sig, ids))
+
+    @property
+    def num_states(self):
+        # number of stored states: reset state, complete cycles, and trailing changes
+        return len(self.cycle_offsets) - 1
+
+    def changed(self, cycle):
+        # signals whose value changed when advancing from cycle - 1 to cycle
+        return self.cycle_changes[self.cycle_offsets[cycle]:self.cycle_offsets[cycle + 1]]
+
+    def position(self, sig, cycle):
+        # position of the last change of signal sig at or before cycle
+        return bisect_right(self.sig_cycles[sig], cycle) - 1
+
+    def value(self, sig, pos):
+        assert(pos >= 0), "Signal %s has no value yet" % self.ids[sig]
+        # returns the value as (bits, xmask, zmask)
+        nbytes = self.sig_bytes[sig]
+        start, end = pos * nbytes, (pos + 1) * nbytes
+        bits = int.from_bytes(self.sig_values[sig][start:end], "little")
+        if self.sig_xmasks[sig] is None:
+            return (bits, 0, 0)
+        return (bits,
+                int.from_bytes(self.sig_xmasks[sig][start:end], "little"),
+                int.from_bytes(self.sig_zmasks[sig][start:end], "little"))
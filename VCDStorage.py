@@ -1,57 +1,170 @@
-from bisect import bisect_left
-import os
+from array import array
+import bz2
+import gzip
+import itertools
+import lzma
+import time
 
 import helpers
+from VCDIndex import VCDIndex, VCDIndexWriter, INDEX_SUFFIX, source_stamp, write_index
 from CircuitGraph import CONST_TO_BIT
 CONST_NAMES = {("const_%s" % x) for x in CONST_TO_BIT.keys()}
 DUMMIES = ["$scope", "$upscope", "$enddefinitions", "$date", "$version"]
+COMPRESSED_OPENERS = {".gz": gzip.open, ".xz": lzma.open, ".lzma": lzma.open, ".bz2": bz2.open}
+CHUNK_SIZE = 1 << 22  # characters
+# translation tables to split a value string into bits, x mask and z mask
+BITS_TABLE = str.maketrans("01xzXZ", "010000")
+XMASK_TABLE = str.maketrans("01xzXZ", "001010")
+ZMASK_TABLE = str.maketrans("01xzXZ", "000101")
+SCALARS = {"0": (0, 0, 0), "1": (1, 0, 0)}
+# one byte codes of single bit values in dense value arrays
+CODE_X, CODE_Z, CODE_NONE = 2, 3, 255
+VALUE_CODES = {"0": 0, "1": 1, "x": CODE_X, "z": CODE_Z}
 
 
-def peek_line(f):
-    pos = f.tell()
-    line = f.readline()
-    f.seek(pos)
-    return line
+def open_vcd(vcd_file_path):
+    # compressed traces are decompressed while streaming
+    for suffix, opener in COMPRESSED_OPENERS.items():
+        if vcd_file_path.endswith(suffix):
+            return opener(vcd_file_path, "rt")
+    return open(vcd_file_path, "r")
+
+
+def tokenize(stream, chunk_size=CHUNK_SIZE):
+    # split the stream into lists of whitespace separated tokens, one list per chunk
+    rest = ""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            if rest: yield [rest]
+            return
+        tokens = (rest + chunk).split()
+        # the last token might continue in the next chunk
+        rest = "" if (chunk[-1].isspace() or len(tokens) == 0) else tokens.pop()
+        yield tokens
+
+
+def pack_value(signal_value, width):
+    # returns (bits, xmask, zmask), the value is padded with x if it contains an x and with 0 otherwise
+    try:
+        return (int(signal_value, 2), 0, 0)
+    except ValueError:
+        pass
+    xmask = int(signal_value.translate(XMASK_TABLE), 2)
+    if xmask and len(signal_value) < width:
+        xmask |= ((1 << (width - len(signal_value))) - 1) << len(signal_value)
+    return (int(signal_value.translate(BITS_TABLE), 2), xmask, int(signal_value.translate(ZMASK_TABLE), 2))
+
+
+def value_bit(value, bit_num):
+    # single bit of a packed value as "0", "1", "x" or "z"
+    bits, xmask, zmask = value
+    if (xmask | zmask) >> bit_num & 1:
+        return "x" if xmask >> bit_num & 1 else "z"
+    return "1" if bits >> bit_num & 1 else "0"
+
+
+def value_code(value, bit_num):
+    # single bit of a packed value as one byte code
+    bits, xmask, zmask = value
+    if (xmask | zmask) >> bit_num & 1:
+        return CODE_X if xmask >> bit_num & 1 else CODE_Z
+    return bits >> bit_num & 1
+
+
+def value_str(value, width):
+    # packed value as string with the most significant bit first
+    bits, xmask, zmask = value
+    if not (xmask | zmask):
+        return format(bits, "0%db" % width)
+    return "".join(value_bit(value, b) for b in reversed(range(width)))
+
+
+def select_ids(name_to_id, signals):
+    # vcd_ids of all given signal names, including the per-bit entries of split signals
+    if signals is None: return None
+    ids = set()
+    for name, vcd_id in name_to_id.items():
+        if name in signals or name.split(" [")[0] in signals:
+            ids.add(vcd_id)
+    return ids
 
 
 class VCDStorage:
-    def __init__(self, vcd_file_path):
+    def __init__(self, vcd_file_path, index_file_path=None, signals=None):
         self.name_to_id = {}       # key: name, value: vcd_id
         self.id_to_width = {}      # key: vcd_id, value: int width
-        self.current_values = {}   # key: vcd_id, value: current value
-        self.previous_values = {}  # key: vcd_id, value: previous value
-        self.vcd_file = open(vcd_file_path, "r")
+        self.current_values = {}   # key: vcd_id, value: current (bits, xmask, zmask)
+        self.previous_values = {}  # key: vcd_id, value: previous (bits, xmask, zmask) (only for signals changed in this cycle)
+        self.vcd_file = None
+        self.tokens = None     # token iterator of the VCD body
+        self.next_ts = None    # timestamp that has been read but not processed yet
         self.cycle = 0
+        self.changed_sigs = ()  # index signals whose value was updated in the current cycle
         self.timestamps = []
         self.vcd_file_path = vcd_file_path
-        self.line_nr = 0  # last read line number
-        self.parse_header()
+        self.index_file_path = index_file_path
+        if self.index_file_path is None:
+            self.index_file_path = vcd_file_path + INDEX_SUFFIX
+        self.line_nr = 0  # last read line number in the header
+        self.whitelist = None  # vcd_ids whose values are parsed, None for all
+        self.index = VCDIndex.load(self.index_file_path, vcd_file_path)
+        keep_ids = set()
+        if self.index is not None and not self.index.covers(select_ids(self.index.all_names, signals)):
+            # extend the existing index so that alternating runs do not rebuild it every time
+            keep_ids = set(self.index.ids)
+            self.index = None
+        if self.index is None:
+            self.index = self.build_index(signals, keep_ids)
+        self.name_to_id = self.index.name_to_id
+        self.id_to_width = self.index.id_to_width
+        self.timestamps = self.index.timestamps
+        self.positions = array("q")  # signal -> position of the current value in the index
+        self.seek_cycle(0)
 
     def __del__(self):
-        self.vcd_file.close()
+        if self.vcd_file is not None:
+            self.vcd_file.close()
 
     def _readline(self):
         self.line_nr = self.line_nr + 1
         return self.vcd_file.readline()
 
-    def parse_signal(self, vcd_line):
-        signal_value, signal_id = None, None
-        if vcd_line[0] == "b":
-            assert(" " in vcd_line[1:])
-            signal_value, signal_id = vcd_line[1:].split(" ")#
-        elif vcd_line[0] == "r":
-            print("{}:{}: [WARNING] ignoring unsupported assignment of type real".format(self.vcd_file_path, self.line_nr))
-            signal_id = vcd_line[1:].split(" ")[1]
-            signal_value = 64*'0'
+    def parse_signal(self, token, signal_id):
+        assert(signal_id in self.id_to_width), "%s: Signal with id %s not found." % (self.vcd_file_path, signal_id)
+        if token[0] == "0" or token[0] == "1":
+            return SCALARS[token[0]]
+        elif token[0] == "b":
+            signal_value = token[1:]
+        elif token[0] == "r":
+            print("{}: [WARNING] ignoring unsupported assignment of type real".format(self.vcd_file_path))
+            return (0, 0, 0)
         else:
-            assert (" " not in vcd_line)
-            signal_value, signal_id = vcd_line[0], vcd_line[1:]
-        fill = "x" if "x" in signal_value else "0"
-        signal_value = signal_value.rjust(self.id_to_width[signal_id], fill)
-        # print("{}:{}: {} = {}".format(self.vcd_file_path, self.line_nr, signal_id, signal_value))
-        return signal_value, signal_id
-
-    def parse_header(self):
+            signal_value = token[0]
+        # print("{}: {} = {}".format(self.vcd_file_path, signal_id, signal_value))
+        return pack_value(signal_value, self.id_to_width[signal_id])
+
+    def parse_changes(self, changes):
+        # parse value changes into changes until the next timestamp, which is returned (None at the end)
+        whitelist = self.whitelist
+        tokens = self.tokens
+        for token in tokens:
+            kind = token[0]
+            if kind == "#":
+                return int(token[1:])
+            if kind == "$":
+                # $dumpvars, $end, ...
+                continue
+            if kind == "b" or kind == "r":
+                signal_id = next(tokens)
+            else:
+                signal_id = token[1:]
+            if whitelist is not None and signal_id not in whitelist: continue
+            changes[signal_id] = self.parse_signal(token, signal_id)
+        return None
+
+    def parse_header(self, signals=None, keep_ids=()):
+        # signals: names of the signals to parse (None for all), keep_ids: additional vcd_ids to parse
         while True:
             line = self._readline()
             if line == "": return
@@ -100,62 +213,163 @@ class VCDStorage:
                 print("%s:%d: [WARNING] Ignoring unknown VCD header line: %s." % (
                     self.vcd_file_path, self.line_nr, line[0]))
                 break
+        self.whitelist = select_ids(self.name_to_id, signals)
+        if self.whitelist is not None:
+            self.whitelist.update(keep_ids)
+        # the body is read in large chunks
+        self.tokens = itertools.chain.from_iterable(tokenize(self.vcd_file))
+        self.next_ts = self.parse_changes(self.current_values)
+
+    def parse_cycle_text(self, changes):
+        # reads the value changes of the next cycle from the text file into changes
+        ts = self.next_ts
+        self.next_ts = None
         while True:
-            line = peek_line(self.vcd_file)
-            if line[0] == "#": break
-            line = self._readline()
-            if line.strip() in ("$dumpvars", "$end"): continue
-            if line == "": return
-            signal_value, signal_id = self.parse_signal(line.strip())
-            self.current_values[signal_id] = str(signal_value)
+            if ts is None:
+                ts = self.parse_changes(changes)
+                if ts is None: return False
+            assert(len(self.timestamps) < 2 or
+                   self.timestamps[-1] - self.timestamps[-2] == ts - self.timestamps[-1])
+            self.timestamps.append(ts)
+            if len(self.timestamps) % 2 == 1:
+                return True
+            ts = None
+
+    def build_index(self, signals=None, keep_ids=()):
+        t1 = time.time()
+        print("Indexing %s" % self.vcd_file_path)
+        self.vcd_file = open_vcd(self.vcd_file_path)
+        self.parse_header(signals, keep_ids)
+        writer = VCDIndexWriter(self.name_to_id, self.id_to_width, self.whitelist)
+        writer.add_cycle(self.current_values)
+        num_cycles = 0
+        while True:
+            changes = {}
+            more = self.parse_cycle_text(changes)
+            writer.add_cycle(changes)
+            if not more: break
+            num_cycles += 1
+        self.vcd_file.close()
+        self.vcd_file = None
+        self.tokens = None
+        data = writer.serialize(num_cycles, self.timestamps, source_stamp(self.vcd_file_path))
+        index = None
+        try:
+            write_index(self.index_file_path, data)
+            index = VCDIndex.load(self.index_file_path, self.vcd_file_path)
+        except OSError as e:
+            print("[WARNING] Could not write index %s (%s), keeping it in memory" % (self.index_file_path, e))
+        if index is None:
+            index = VCDIndex.from_bytes(data)
+        t2 = time.time()
+        print("Indexed %d cycles in %.2f" % (num_cycles, t2 - t1))
+        return index
+
+    def __state_at(self, cycle):
+        values = {}
+        cycle = min(cycle, self.index.num_states - 1)
+        for sig, vcd_id in enumerate(self.index.ids):
+            pos = self.index.position(sig, cycle)
+            if pos < 0: continue
+            values[vcd_id] = self.index.value(sig, pos)
+        return values
+
+    def seek_cycle(self, cycle):
+        # random access to any cycle, 0 is the state right after the header
+        assert(cycle >= 0)
+        self.cycle = cycle
+        self.changed_sigs = ()
+        self.current_values = self.__state_at(cycle)
+        self.previous_values = {}
+        state = min(cycle, self.index.num_states - 1)
+        self.positions = array("q", (self.index.position(sig, state) for sig in range(len(self.index.ids))))
+        if state == cycle and cycle > 0:
+            self.changed_sigs = self.index.changed(cycle)
+            for sig in self.changed_sigs:
+                if self.positions[sig] == 0: continue
+                self.previous_values[self.index.ids[sig]] = self.index.value(sig, self.positions[sig] - 1)
+        return self.cycle <= self.index.num_cycles
 
     def parse_next_cycle(self):
+        # only signals that change are journaled, so advancing costs O(changed signals)
         self.cycle += 1
-        self.previous_values = self.current_values.copy()
-        while True:
-            line = self._readline()
-            if not line:
-                break
-            line = line.strip()
-            if line.startswith("#"):
-                ts = int(line.replace("#", ""))
-                assert(len(self.timestamps) < 2 or
-                       self.timestamps[-1] - self.timestamps[-2] == ts - self.timestamps[-1])
-                self.timestamps.append(ts)
-                if len(self.timestamps) % 2 == 1:
-                    return True
-            else:
-                signal_value, signal_id = self.parse_signal(line)
-                assert(signal_id in self.current_values), "%s:%d: Signal with id %s not found." % (
-                    self.vcd_file_path, self.line_nr, signal_id)
-                self.current_values[signal_id] = str(signal_value)
-        return False
+        self.previous_values = {}
+        self.changed_sigs = ()
+        if self.cycle < self.index.num_states:
+            self.changed_sigs = self.index.changed(self.cycle)
+            for sig in self.changed_sigs:
+                vcd_id = self.index.ids[sig]
+                self.positions[sig] += 1
+                if vcd_id in self.current_values:
+                    self.previous_values[vcd_id] = self.current_values[vcd_id]
+                self.current_values[vcd_id] = self.index.value(sig, self.positions[sig])
+        return self.cycle <= self.index.num_cycles
 
-    # @profile
-    def get_signal_value(self, signal_name, bit_num, prev=False):
-        if signal_name in CONST_NAMES: return signal_name[-1]
-        values = self.previous_values if prev else self.current_values
+    @property
+    def changed(self):
+        # vcd_ids of all signals that changed in the current cycle
+        return self.previous_values.keys()
+
+    def __lookup(self, vcd_id, prev):
+        if prev:
+            value = self.previous_values.get(vcd_id)
+            if value is not None: return value
+        return self.current_values[vcd_id]
+
+    def resolve(self, signal_name, bit_num):
+        # resolve a single bit of a signal to a handle (vcd_id, bit number)
+        # constants are resolved to (None, value), unknown signals to None
+        if signal_name in CONST_NAMES: return (None, signal_name[-1])
         # Verilator < 4.106 truncates long signal names
-        # assert (signal_name in self.name_to_id), "Signal not found in VCD file"
+        # Look for the signal incl. the specific index.
+        id_name = self.name_to_id.get("{} [{}]".format(signal_name, bit_num), None)
+        if id_name:
+            return (id_name, 0)
 
-        if bit_num is not None:
-            # Look for the signal incl. the specific index.
-            id_name = self.name_to_id.get("{} [{}]".format(signal_name, bit_num), None)
-            if id_name:
-                return values[id_name]
+        # Look for the signal in full width and extract the specific bit.
+        id_name = self.name_to_id.get(signal_name, None)
+        if id_name is None: return None
+        assert (bit_num >= 0 and bit_num < self.id_to_width[id_name]), \
+            "Invalid bit index %d for %s" % (bit_num, signal_name)
+        return (id_name, bit_num)
+
+    def get_value(self, handle, prev=False):
+        vcd_id, idx = handle
+        if vcd_id is None: return idx
+        return value_bit(self.__lookup(vcd_id, prev), idx)
+
+    def get_values(self, handles, prev=False):
+        # bulk lookup of pre-resolved handles, unresolved handles yield None
+        if not prev:
+            values = self.current_values
+            return [None if h is None else (h[1] if h[0] is None else value_bit(values[h[0]], h[1])) for h in handles]
+        return [None if h is None else (h[1] if h[0] is None else value_bit(self.__lookup(h[0], True), h[1]))
+                for h in handles]
 
-            # Look for the signal in full width and extract the specific bit.
-            id_name = self.name_to_id.get(signal_name, None)
-            assert id_name, "Signal %s not found in VCD file" % signal_name
+    def get_codes(self, handles, prev=False):
+        # like get_values, but returns one byte code per handle
+        codes = bytearray(len(handles))
+        for i, h in enumerate(handles):
+            if h is None:
+                codes[i] = CODE_NONE
+            elif h[0] is None:
+                codes[i] = VALUE_CODES[h[1]]
+            else:
+                codes[i] = value_code(self.__lookup(h[0], prev), h[1])
+        return codes
 
-            full_val = values[id_name]
-            assert (bit_num >= 0 and bit_num < len(full_val)), "Invalid bit index %d for %s" % (bit_num, signal_name)
-            return full_val[-1 - bit_num]
+    # @profile
+    def get_signal_value(self, signal_name, bit_num, prev=False):
+        if bit_num is not None:
+            handle = self.resolve(signal_name, bit_num)
+            assert handle, "Signal %s not found in VCD file" % signal_name
+            return self.get_value(handle, prev)
 
+        if signal_name in CONST_NAMES: return signal_name[-1]
         # All bits of a signal are requested, look for the signal.
         id_name = self.name_to_id.get(signal_name, None)
         if id_name:
-            return values[id_name]
+            return value_str(self.__lookup(id_name, prev), self.id_to_width[id_name])
 
         # Reconstruct the full width signal by concatenating individual bits.
         idx = 0
@@ -163,8 +377,52 @@ class VCDStorage:
         while True:
             id_name = self.name_to_id.get("{} [{}]".format(signal_name, idx), None)
             if id_name is None: break
-            full_val = values[id_name] + full_val
+            full_val = value_bit(self.__lookup(id_name, prev), 0) + full_val
             idx = idx + 1
 
         assert len(full_val), "Signal %s not found in VCD file" % signal_name
         return full_val
+
+
+class TraceValues:
+    """Dense arrays with the previous and current value codes of a fixed list of handles.
+
+    When the trace advances by a single cycle, only the entries of changed signals are updated.
+    """
+    def __init__(self, trace, handles):
+        self.trace = trace
+        self.handles = handles
+        self.readers = {}  # index signal -> [(position, bit_num)]
+        for pos, h in enumerate(handles):
+            if h is None or h[0] is None: continue
+            sig = trace.index.id_to_sig[h[0]]
+            self.readers.setdefault(sig, []).append((pos, h[1]))
+        self.cycle = None
+        self.prev = None
+        self.curr = None
+
+    def update(self):
+        trace = self.trace
+        if self.cycle == trace.cycle: return
+        if self.cycle is None or self.cycle + 1 != trace.cycle:
+            self.prev = trace.get_codes(self.handles, True)
+            self.curr = trace.get_codes(self.handles)
+            self.cycle = trace.cycle
+            return
+        # the old current values become the previous values
+        prev, curr = self.curr, self.prev
+        curr[:] = prev
+        ids = trace.index.ids
+        for sig in trace.changed_sigs:
+            readers = self.readers.get(sig)
+            if readers is None: continue
+            vcd_id = ids[sig]
+            value = trace.current_values[vcd_id]
+            for pos, bit_num in readers:
+                curr[pos] = value_code(value, bit_num)
+            if vcd_id not in trace.previous_values:
+                # first value of the signal, its previous value is the current one
+                for pos, _ in readers:
+                    prev[pos] = curr[pos]
+        self.prev, self.curr = prev, curr
+        self.cycle = trace.cycle
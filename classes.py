@@ -1,6 +1,9 @@
+from array import array
+from bisect import bisect_left
 from dataclasses import dataclass
-from defines import inv_cell_enum
-from Solver import Solver, make_xor_bool, make_and_bool_, make_or_bool_
+from defines import inv_cell_enum, PROP_ZERO, PROP_ONE
+from helpers import bit_positions
+from Solver import Solver, make_and_bool_, make_or_bool_
 
 
 @dataclass
@@ -28,8 +31,9 @@ class PropVarSet:
     __counter = 0   # static counter
     __num_vars = 0  # total number of variables for a node
     id:   int       # unique identifier
-    vars: dict      # index -> prop
-    ones: set       # set of fixed ones
+    idx:  array     # sorted indices of the non-constant entries
+    lits: array     # props of the non-constant entries, aligned with idx
+    ones: int       # bitmask of fixed ones
 
     def __init__(self, num=None, biased=None, xor=None, choice=None, solver=None):
         self.id = PropVarSet.__counter
@@ -68,8 +72,8 @@ class PropVarSet:
             else: assert(num == biased.__num_vars)
 
         self.__num_vars = num
-        self.vars = {}
-        self.ones = set()
+        vars = {}  # index -> prop
+        self.ones = 0
 
         if biased is not None:
             # add the condition that (new = old) or (new = 0)
@@ -78,49 +82,52 @@ class PropVarSet:
             # when p = q, then -b is encoded twice, so we replace q with -p
             # (p -> (a = b)) | (-p -> -a)
 
-            assert(len(biased.vars) != 0 or len(biased.ones) != 0)
+            assert(len(biased.idx) != 0 or biased.ones != 0)
             p = solver.get_var()
-            solver.add_comment("bias var %d used for %d" % (p, self.id))
+            solver.add_comment("bias var %d used for %d", p, self.id)
             # for a fixed one, the new value is equal to p:
             # if p is 1, then we have to take the old value, which is 1
             # if p is 0, we have to take the value 0, which is also p
-            for i in biased.ones:
-                self.vars[i] = p
+            for i in bit_positions(biased.ones):
+                vars[i] = p
             # this is the simplified version that uses resolution
-            for i in biased.vars:
-                b = biased.vars[i]
+            for i, b in zip(biased.idx, biased.lits):
                 a = solver.get_var()
-                self.vars[i] = a
+                vars[i] = a
                 solver.add_clauses([[-a, b], [p, -a], [-p, a, -b]])
 
         if c_good:
             arg0, arg1 = choice
             p = solver.get_var()
-            for i in range(self.__num_vars):
-                x, y = arg0[i], arg1[i]
+            # positions where both arguments are zero stay zero
+            vars0, vars1 = arg0.__vars(), arg1.__vars()
+            positions = set(vars0).union(vars1).union(bit_positions(arg0.ones | arg1.ones))
+            for i in sorted(positions):
+                x = vars0.get(i, PROP_ONE if (arg0.ones >> i) & 1 else PROP_ZERO)
+                y = vars1.get(i, PROP_ONE if (arg1.ones >> i) & 1 else PROP_ZERO)
                 # check and simplification
-                if x == "1":
+                if x == PROP_ONE:
                     x = -p
-                if y == "1":
+                if y == PROP_ONE:
                     y = p
                 # check or simplification
-                if type(x) == int and type(y) == int and x == -y:
-                    self.ones.add(i)
+                if x != PROP_ZERO and x == -y:
+                    self.ones |= 1 << i
                     continue
                 # build formula
                 res = None
                 if x == -p or y == p:
-                    if y == "0": res = x
-                    elif x == "0": res = y
+                    if y == PROP_ZERO: res = x
+                    elif x == PROP_ZERO: res = y
                     else:
                         res = solver.get_var()
                         solver.add_clauses(make_or_bool_(x, y, res))
                 else:
                     x_, y_ = None, None
-                    if x != "0":
+                    if x != PROP_ZERO:
                         x_ = solver.get_var()
                         solver.add_clauses(make_and_bool_(-p, x, x_))
-                    if y != "0":
+                    if y != PROP_ZERO:
                         y_ = solver.get_var()
                         solver.add_clauses(make_and_bool_(+p, y, y_))
                     if x_ is None and y_ is None: continue
@@ -131,42 +138,58 @@ class PropVarSet:
                         res = solver.get_var()
                         solver.add_clauses(make_or_bool_(x_, y_, res))
                 assert(res is not None)
-                self.vars[i] = res
+                vars[i] = res
 
         if x_good:
             arg0, arg1 = xor
-            # print(arg0, arg1)
-
-            for i in range(self.__num_vars):
-                x, y = arg0[i], arg1[i]
-                tx, ty = type(x), type(y)
+            # the fixed ones cancel out, unless the other argument has a prop at that position
+            vars0, vars1 = arg0.__vars(), arg1.__vars()
+            self.ones = arg0.ones ^ arg1.ones
+            for i in sorted(set(vars0).union(vars1)):
+                bit = 1 << i
+                self.ones &= ~bit
+                x = vars0.get(i, PROP_ONE if arg0.ones & bit else PROP_ZERO)
+                y = vars1.get(i, PROP_ONE if arg1.ones & bit else PROP_ZERO)
                 # xor is zero
                 if x == y: pass
                 # xor is one
-                elif ((x, y) in (("0", "1"), ("1", "0")) or
-                      (ty == int and tx == int and x == -y)):
-                    self.ones.add(i)
+                elif x == -y:
+                    self.ones |= bit
                 # xor is the left
-                elif tx == int and ty == str:
-                    self.vars[i] = x if (y == "0") else -x
+                elif y in (PROP_ZERO, PROP_ONE):
+                    vars[i] = x if (y == PROP_ZERO) else -x
                 # xor is the right
-                elif tx == str and ty == int:
-                    self.vars[i] = y if (x == "0") else -y
+                elif x in (PROP_ZERO, PROP_ONE):
+                    vars[i] = y if (x == PROP_ZERO) else -y
                 else:
-                    assert(tx == int and ty == int), "type mismatch: %s %s ; %s %s" % (x, y, tx, ty)
-                    z = solver.get_var()
-                    solver.add_clauses(make_xor_bool(x, y, z))
-                    self.vars[i] = z
-        pass
-
-    def __getitem__(self, idx):
-        assert(idx < self.__num_vars), "%d and %d" % (idx, self.__num_vars)
-        q = self.vars.get(idx)
-        if q is not None: return self.vars[idx]
-        else: return str((idx in self.ones) & 1)
+                    vars[i] = solver.make_xor(x, y)
+
+        self.idx = array("I", sorted(vars))
+        self.lits = array("q", (vars[i] for i in self.idx))
+
+    def __vars(self):
+        return dict(zip(self.idx, self.lits))
+
+    def __getitem__(self, i):
+        assert(i < self.__num_vars), "%d and %d" % (i, self.__num_vars)
+        j = bisect_left(self.idx, i)
+        if j < len(self.idx) and self.idx[j] == i: return self.lits[j]
+        return PROP_ONE if (self.ones >> i) & 1 else PROP_ZERO
+
+    def key(self):
+        # canonical content, equal for PropVarSets with the same entries
+        return (self.idx.tobytes(), self.lits.tobytes(), self.ones)
+
+    def is_zero(self):
+        return self.ones == 0 and len(self.idx) == 0
 
     def tuple(self):
-        return tuple(self.__getitem__(i) for i in range(self.__num_vars))
+        res = [PROP_ZERO] * self.__num_vars
+        for i in bit_positions(self.ones):
+            res[i] = PROP_ONE
+        for i, lit in zip(self.idx, self.lits):
+            res[i] = lit
+        return tuple(res)
 
 
 @dataclass
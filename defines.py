@@ -41,6 +41,9 @@ LIST_XOR = "shallow"
 TRIGGERS = {AND_TYPE: "0", OR_TYPE: "1", XOR_TYPE: None, XNOR_TYPE: None}
 BIN_STR = ("0", "1")
 UINT_MAX = 0xffffffffff
+# constant entries of a PropVarSet, solver literals are never 0 and stay far below PROP_ONE
+PROP_ZERO = 0
+PROP_ONE = UINT_MAX
 
 # define commonly used keys
 TRANSIENT = "transient"
@@ -122,3 +122,12 @@ def parity(num):
         num >>= 1
     return res % 2
 
+
+
+def bit_positions(mask):
+    # positions of the set bits of mask in increasing order
+    assert(mask >= 0)
+    while mask != 0:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
@@ -10,7 +10,6 @@ import defines
 import helpers
 import time
 from CircuitGraph import CircuitGraph
-from SafeGraph import SafeGraph
 
 
 LABEL_FILE_PATH = defines.TMP_DIR + "/labels.txt"
@@ -185,9 +184,6 @@ def main():
     create_label_template(circuit_json, args.label_file_path, args.top_module)
 
     circuit_graph = CircuitGraph(circuit_json, args.top_module)
-    # circuit_graph.write_pickle()
-    # safe_graph = SafeGraph(circuit_graph.graph)
-    # safe_graph.write_pickle()
     
     tstp_end = time.time()
     print("parse.py successful (%.2fs)"%(tstp_end-tstp_begin))
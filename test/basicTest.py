@@ -1,4 +1,8 @@
+import bz2
+import gzip
+import lzma
 import pytest
+import shutil
 import subprocess
 import sys
 import time
@@ -181,6 +185,67 @@ def test_dom_and_1storder_broken():
     vc.runtime = time.time() - t
     assert verify_process.returncode != 0
 
+@pytest.mark.timeout(120)
+def test_dom_and_1storder_broken_options():
+    args = ["mkdir", "tmp/"]
+    subprocess.run(args)
+    
+    args = ["python3", "parse.py", "--top-module", "dom_and_1storder_broken", "--source", "examples/gadgets/design/dom_and.v", "--netlist", "tmp/circuit.v", "--yosys", YOSYS_BIN]
+    parse_process = subprocess.run(args, input="Y".encode(),stdout=sys.stdout, stderr=sys.stderr)
+    assert parse_process.returncode == 0
+
+
+    args = ["sed", "-i", "s/TC_NAME/dom_and_1storder/g", "examples/gadgets/verilator_tb.cpp"]
+    subprocess.run(args)
+
+    args = ["python3","trace.py","--testbench","examples/gadgets/verilator_tb.cpp","--netlist","tmp/circuit.v"]
+    trace_process = subprocess.run(args,stdout=sys.stdout, stderr=sys.stderr)
+    assert trace_process.returncode == 0
+
+    
+    args = ["sed", "-i", "s/#define TC dom_and_1storder/#define TC TC_NAME/g", "examples/gadgets/verilator_tb.cpp"]
+    subprocess.run(args)
+
+    args = ["cp", "examples/gadgets/labels_dom_and_1storder_broken.txt", "tmp/labels.txt"]
+    label_process = subprocess.run(args,stdout=sys.stdout, stderr=sys.stderr)
+    assert label_process.returncode == 0
+
+    # compressed copies of the trace
+    for suffix, opener in ((".gz", gzip.open), (".xz", lzma.open), (".bz2", bz2.open)):
+        with open("tmp/tmp.vcd", "rb") as src, opener("tmp/tmp.vcd" + suffix, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+
+    # the options must not change the verdicts of test_dom_and_1storder_broken
+    option_sets = [(PER_SECRET, ["--simplify"], "tmp/tmp.vcd"),
+                   (PER_LOCATION, ["--simplify"], "tmp/tmp.vcd"),
+                   (PER_LOCATION, ["--jobs", "2"], "tmp/tmp.vcd"),
+                   (PER_SECRET, ["--window", "2"], "tmp/tmp.vcd"),
+                   (PER_LOCATION, ["--window", "2"], "tmp/tmp.vcd"),
+                   (PER_SECRET, ["--solver", "glucose4"], "tmp/tmp.vcd"),
+                   (PER_LOCATION, ["--portfolio", "minisat22", "glucose4"], "tmp/tmp.vcd"),
+                   (PER_SECRET, ["--card-encoding", "totalizer"], "tmp/tmp.vcd"),
+                   (PER_SECRET, ["--card-encoding", "pairwise"], "tmp/tmp.vcd"),
+                   (PER_SECRET, [], "tmp/tmp.vcd.gz"),
+                   (PER_SECRET, [], "tmp/tmp.vcd.xz"),
+                   (PER_LOCATION, [], "tmp/tmp.vcd.bz2")]
+    contextMap["dom_and_1storder_broken options"] = []
+    for checking_mode, extra_args, vcd in option_sets:
+        vc: VerificationContext = VerificationContext("dom_and_1storder_broken", 5, STABLE, TIME_CONSTRAINED, checking_mode,
+                                                      extra_args=extra_args, vcd=vcd)
+        contextMap["dom_and_1storder_broken options"].append(vc)
+        t = time.time()
+        verify_process = subprocess.run(vc.toCmdArgs(),stdout=sys.stdout, stderr=sys.stderr)
+        vc.runtime = time.time() - t
+        assert verify_process.returncode == 0
+
+        vc: VerificationContext = VerificationContext("dom_and_1storder_broken", 5, TRANSIENT, TIME_CONSTRAINED, checking_mode,
+                                                      extra_args=extra_args, vcd=vcd)
+        contextMap["dom_and_1storder_broken options"].append(vc)
+        t = time.time()
+        verify_process = subprocess.run(vc.toCmdArgs(),stdout=sys.stdout, stderr=sys.stderr)
+        vc.runtime = time.time() - t
+        assert verify_process.returncode != 0
+
 @pytest.mark.timeout(30)
 def test_dom_and_2ndorder():
     args = ["mkdir", "tmp/"]
@@ -0,0 +1,184 @@
+import itertools
+import os
+import random
+import sys
+
+import networkx as nx
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from defines import *
+from classes import Cell
+from Cardinality import AtMostK, benchmark_encodings
+from SafeGraph import topological_order
+from Simplifier import Simplifier, CONST_0, CONST_1
+from Solver import Solver
+from VCDIndex import VCDIndex
+from VCDStorage import VCDStorage
+
+GATE_OPS = {AND_TYPE: lambda a, b: a & b, OR_TYPE: lambda a, b: a | b,
+            XOR_TYPE: lambda a, b: a ^ b, XNOR_TYPE: lambda a, b: 1 - (a ^ b)}
+
+
+def random_circuit(rnd, num_ports, num_regs, num_cells):
+    # graph like CircuitGraph builds it, the select of a mux is no edge and a gate may use one input twice
+    graph = nx.DiGraph()
+    inputs = {}
+    graph.add_node(CONST_0, cell=Cell("const_0", CONST_TYPE, 0))
+    graph.add_node(CONST_1, cell=Cell("const_1", CONST_TYPE, 0))
+    sources = list(range(2, 2 + num_ports + num_regs))
+    for n in sources:
+        n_type = PORT_TYPE if n < 2 + num_ports else REGISTER_TYPES[0]
+        graph.add_node(n, cell=Cell("s%d" % n, n_type, 0))
+    nodes = [CONST_0, CONST_1] + sources
+    for n in range(len(nodes), len(nodes) + num_cells):
+        n_type = rnd.choice(list(GATE_TYPES) * 2 + [NOT_TYPE, MUX_TYPE])
+        # mostly recent nodes, so that the circuit gets deep
+        pick = lambda: nodes[max(0, len(nodes) - 1 - int(rnd.expovariate(0.2)))]
+        if n_type == NOT_TYPE:
+            inputs[n] = [pick()]
+            graph.add_node(n, cell=Cell("n%d" % n, n_type, 0))
+        elif n_type == MUX_TYPE:
+            inputs[n] = [pick(), pick(), pick()]
+            graph.add_node(n, cell=Cell("n%d" % n, n_type, 0, select=inputs[n][0], mux_ins=inputs[n][1:]))
+        else:
+            inputs[n] = [pick(), rnd.choice(nodes)]
+            graph.add_node(n, cell=Cell("n%d" % n, n_type, 0))
+        for p in inputs[n][1:] if n_type == MUX_TYPE else inputs[n]:
+            graph.add_edge(p, n)
+        nodes.append(n)
+    # registers take their input from any cell
+    for n in sources[num_ports:]:
+        graph.add_edge(rnd.choice(nodes), n)
+    return graph
+
+
+def evaluate(graph, order, source_values):
+    # value of every node, the sources get the given values
+    values = {CONST_0: 0, CONST_1: 1}
+    values.update(source_values)
+    for n in order:
+        if n in values: continue
+        cell = graph.nodes[n]["cell"]
+        preds = list(graph.predecessors(n))
+        if cell.type == NOT_TYPE:
+            values[n] = 1 - values[preds[0]]
+        elif cell.type == MUX_TYPE:
+            values[n] = values[cell.mux_ins[values[cell.select]]]
+        else:
+            # a gate with one predecessor has two identical inputs
+            values[n] = GATE_OPS[cell.type](values[preds[0]], values[preds[-1]])
+    return values
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_topological_order(seed):
+    rnd = random.Random(seed)
+    graph = random_circuit(rnd, 4, 3, 60)
+    order = topological_order(graph)
+    assert sorted(order) == sorted(graph.nodes())
+    position = {n: i for i, n in enumerate(order)}
+    for n in graph.nodes():
+        cell = graph.nodes[n]["cell"]
+        if cell.type in REGPORT_TYPES or cell.type == CONST_TYPE: continue
+        preds = list(graph.predecessors(n))
+        if cell.type == MUX_TYPE: preds.append(cell.select)
+        assert all(position[p] < position[n] for p in preds), n
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_simplifier_preserves_values(seed):
+    rnd = random.Random(seed)
+    graph = random_circuit(rnd, 4, 3, 80)
+    simplifier = Simplifier(graph)
+    assert len(simplifier.graph) + len(simplifier.representatives) == len(graph)
+    sources = [n for n in graph.nodes() if graph.nodes[n]["cell"].type in REGPORT_TYPES]
+    orig_order = topological_order(graph)
+    simple_order = topological_order(simplifier.graph)
+    for _ in range(16):
+        source_values = {n: rnd.randint(0, 1) for n in sources}
+        orig_values = evaluate(graph, orig_order, source_values)
+        simple_values = evaluate(simplifier.graph, simple_order, source_values)
+        for n in graph.nodes():
+            assert orig_values[n] == simple_values[simplifier.rep(n)], n
+
+
+@pytest.mark.parametrize("k", [1, 2, 3])
+def test_at_most_k(k):
+    n = 6
+    for encoding in benchmark_encodings(k):
+        solver = Solver()
+        xs = list(solver.get_vars(n))
+        card = AtMostK(k, encoding)
+        # extended in two steps, like the probes of two cycles
+        solver.add_at_most_k(card, xs[:n // 2])
+        solver.add_at_most_k(card, xs[n // 2:])
+        for bits in itertools.product((0, 1), repeat=n):
+            assumptions = [x if b else -x for x, b in zip(xs, bits)]
+            assert solver.solve(assumptions) == (sum(bits) <= k), (encoding, bits)
+
+
+def write_random_vcd(path, rnd, num_ts):
+    # returns the values of clk_i and data after each timestamp
+    lines = ["$timescale 1ps $end", "$scope module top $end", "$var wire 1 ! clk_i $end",
+             "$var wire 4 \" data [3:0] $end", "$upscope $end", "$enddefinitions $end"]
+    values = []
+    for ts in range(num_ts):
+        clk = str(ts % 2)
+        data = "".join(rnd.choice("0101x") for _ in range(4))
+        lines += ["#%d" % ts] + (["$dumpvars"] if ts == 0 else [])
+        lines += [clk + "!"]
+        if ts == 0 or rnd.random() < 0.7:
+            lines += ["b%s \"" % data]
+        else:
+            data = values[-1][1]
+        lines += ["$end"] if ts == 0 else []
+        values.append((clk, data))
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return values
+
+
+def check_trace(storage, values, num_cycles):
+    # cycle k holds the changes up to timestamp 2k - 2
+    expected = [values[max(0, 2 * k - 2)] for k in range(num_cycles + 1)]
+    for k in range(num_cycles + 1):
+        if k == 0 or k % 3 == 0:
+            assert storage.seek_cycle(k)
+        else:
+            assert storage.parse_next_cycle()
+        assert (storage.get_signal_value("clk_i", 0), storage.get_signal_value("data", None)) == expected[k]
+        if k != 0:
+            assert storage.get_signal_value("data", None, True) == expected[k - 1][1]
+    assert not storage.parse_next_cycle()
+
+
+def test_vcd_index_round_trip(tmp_path):
+    rnd = random.Random(0)
+    vcd = str(tmp_path / "trace.vcd")
+    num_cycles = 20
+    values = write_random_vcd(vcd, rnd, 2 * num_cycles)
+    # an index of only some signals is extended by later runs
+    storage = VCDStorage(vcd, signals={"clk_i"})
+    assert storage.index.ids == ["!"]
+    storage = VCDStorage(vcd)
+    check_trace(storage, values, num_cycles)
+    index = VCDIndex.load(vcd + ".idx", vcd)
+    assert index is not None and sorted(index.ids) == ["!", "\""]
+    check_trace(VCDStorage(vcd), values, num_cycles)
+
+    # damaged indices are rejected and rebuilt
+    with open(vcd + ".idx", "rb") as f:
+        data = f.read()
+    for size in [0, 8, 40, len(data) // 2, len(data) - 1]:
+        with open(vcd + ".idx", "wb") as f:
+            f.write(data[:size])
+        assert VCDIndex.load(vcd + ".idx", vcd) is None
+        check_trace(VCDStorage(vcd), values, num_cycles)
+        assert os.path.getsize(vcd + ".idx") == len(data)
+
+    # a changed trace makes the index stale
+    values = write_random_vcd(vcd, rnd, 2 * num_cycles)
+    os.utime(vcd, ns=(0, os.stat(vcd + ".idx").st_mtime_ns + 1))
+    assert VCDIndex.load(vcd + ".idx", vcd) is None
+    check_trace(VCDStorage(vcd), values, num_cycles)
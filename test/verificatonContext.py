@@ -11,20 +11,23 @@ PER_LOCATION = "per-location"
 
 
 class VerificationContext:
-    def __init__(self, top_module: str, cycles: int, mode: str, probing_model: str, checking_mode: str, order: int = 0):
+    def __init__(self, top_module: str, cycles: int, mode: str, probing_model: str, checking_mode: str, order: int = 0,
+                 extra_args: list = (), vcd: str = "tmp/tmp.vcd"):
         self.top_module = top_module
         self.cycles = cycles
         self.mode = mode
         self.probing_model = probing_model
         self.checking_mode = checking_mode
         self.order = order
+        self.extra_args = list(extra_args)
+        self.vcd = vcd
         self.runtime = 0
         
     def toCmdArgs(self):
         args = ["python3", "verify.py", \
             "--json","tmp/circuit.json", \
             "--label", "tmp/labels.txt", \
-            "--vcd", "tmp/tmp.vcd",  \
+            "--vcd", self.vcd,  \
             "--rst-name", "rst_i", \
             "--glitch-behavior", "strict", \
             "--cycles", str(self.cycles), \
@@ -35,7 +38,9 @@ class VerificationContext:
         if self.order != 0:
             args.append("--order")
             args.append(str(self.order))
+        args += self.extra_args
         return args
     
     def shortStr(self):
-        return "%s: [%d cycles, %s, %s, %s]"%(self.top_module, self.cycles, self.mode, self.probing_model, self.checking_mode)
+        return "%s: [%d cycles, %s, %s, %s%s]"%(self.top_module, self.cycles, self.mode, self.probing_model, self.checking_mode,
+                                               "".join(" " + a for a in self.extra_args))
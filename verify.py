@@ -1,14 +1,15 @@
 #!/usr/bin/env python3
 
-from CircuitGraph import CircuitGraph
+from Cardinality import CARD_ENCODINGS, AT_MOST_ONE_ENCODINGS
+from CircuitCache import load_circuit
 from classes import *
 from defines import *
-from SafeGraph import SafeGraph
+from IgnoredNodes import IgnoredNodes
+from SatBackends import SOLVERS
 from SatChecker import SatChecker
 from VCDStorage import *
 import argparse
 import helpers
-import json
 import networkx as nx
 import sys
 import time
@@ -28,6 +29,10 @@ def parse_arguments():
     parser.add_argument("-v", "--vcd", dest="vcd_file_path",
                         required=True, type=helpers.ap_check_file_exists,
                         help="Path of VCD file")
+    parser.add_argument("--vcd-index", dest="vcd_index_path",
+                        required=False, default=None,
+                        help="Path of the trace index built from the VCD file on the first run "
+                             "(default: VCD file path with .idx suffix)")
     parser.add_argument("-c", "--cycles", dest="cycles",
                         required=False, type=int, default=-1,
                         help="Number of cycles to verify (default: %(default)s; stop when VCD file ends)")
@@ -59,6 +64,48 @@ def parse_arguments():
                         "solver identifies leaking probing locations. 'per-location' means one formula is built per" 
                         "potentially leaking probing locations and the solver identifies combinations of secrets" 
                         "causing leaks (default: %(default)s).")
+    parser.add_argument("--solver", dest="solver",
+                        required=False, default="cadical", choices=SOLVERS,
+                        help="SAT solver to use. 'cryptominisat' keeps XOR constraints in native form and needs "
+                             "the pycryptosat package, 'external' runs the DIMACS solver binary given by "
+                             "--solver-bin for every query, all others are solvers of pysat (default: %(default)s)")
+    parser.add_argument("--solver-bin", dest="solver_bin",
+                        required=False, type=helpers.ap_check_file_exists, default=None,
+                        help="Path to a SAT solver binary that reads DIMACS CNF and answers in the SAT competition "
+                             "format, e.g. Kissat, for the 'external' solver")
+    parser.add_argument("--solver-report", action="store_true", dest="solver_report",
+                        help="Report the number and time of the solver calls")
+    parser.set_defaults(solver_report=False)
+    parser.add_argument("--solver-benchmark", dest="solver_benchmark",
+                        required=False, default=[], nargs="+", choices=SOLVERS,
+                        help="Further solvers that get the same formulas and queries as the solver, their answers "
+                             "are compared and the time of each solver is reported")
+    parser.add_argument("--portfolio", dest="portfolio",
+                        required=False, default=[], nargs="+", choices=SOLVERS,
+                        help="Further solvers that get the same formulas as the solver and race against it: every "
+                             "query is solved by all of them in forked processes and the first answer is used. "
+                             "Each query forks, so this pays off for hard queries")
+    parser.add_argument("--card-encoding", dest="card_encoding",
+                        required=False, default="auto", choices=CARD_ENCODINGS,
+                        help="Encoding of the constraint that at most ORDER probes are active in the per-secret "
+                             "checking mode. 'seqcounter' and 'totalizer' are extended by the probes of each new "
+                             "cycle, all other encodings are built again over all probes in every cycle. 'ladder', "
+                             "'pairwise' and 'bitwise' only support order 1. 'auto' chooses by the order "
+                             "(default: %(default)s)")
+    parser.add_argument("--card-benchmark", action="store_true", dest="card_benchmark",
+                        help="Report the variables and clauses that each cardinality encoding adds in the "
+                             "per-secret checking mode")
+    parser.set_defaults(card_benchmark=False)
+    parser.add_argument("--jobs", dest="jobs",
+                        required=False, type=helpers.ap_check_positive, default=1,
+                        help="Number of processes that check probing locations in the 'per-location' checking "
+                             "mode. The processes only solve, the formulas are built by the main process and "
+                             "the results are the same as for a single process (default: %(default)s)")
+    parser.add_argument("--window", dest="window",
+                        required=False, type=helpers.ap_check_positive, default=None,
+                        help="Only keep the formulas of the last WINDOW cycles in the time-constrained probing "
+                             "model. Probes that are further apart are not combined and the traces of leaks go "
+                             "back at most WINDOW cycles (default: keep all cycles)")
     parser.add_argument("-n", "--num-leaks", dest="num_leaks",
                         required=False, type=int, default=1,
                         help="Number of leakage locations to be reported if the circuit is insecure." 
@@ -100,6 +147,16 @@ def parse_arguments():
     parser.add_argument("--top-module", dest="top_module",
                         required=True, type=str,
                         help="Name of the top module")
+    parser.add_argument("--circuit-cache", dest="circuit_cache_dir",
+                        required=False, default=TMP_DIR,
+                        help="Directory in which parsed circuits are cached, keyed by the content of the JSON "
+                             "file and the top module (default: %(default)s)")
+    parser.add_argument("--no-circuit-cache", dest="circuit_cache_dir", action="store_const", const=None,
+                        help="Always parse the circuit from the JSON file")
+    parser.add_argument("--simplify", action="store_true", dest="simplify",
+                        help="Merge structurally equal cells, propagate constants and fold inverters before "
+                             "verification. Leaks found in merged cells are reported with all their original cells")
+    parser.set_defaults(simplify=False)
 
     args = parser.parse_args()
     # args, unknown = parser.parse_known_args()
@@ -112,6 +169,21 @@ def parse_arguments():
     if args.export_cnf == True and args.probing_model == TIME_CONSTRAINED:
         raise argparse.ArgumentTypeError("Cannot export CNF formulas for time-constrained probing model. " 
                                          "Please use the --probing-model classic option.")
+    if args.window is not None and args.probing_model != TIME_CONSTRAINED:
+        raise argparse.ArgumentTypeError("A window can only be used with the time-constrained probing model.")
+    if args.export_cnf == True and args.solver == "cryptominisat":
+        raise argparse.ArgumentTypeError("Cannot export CNF formulas with native XOR constraints. "
+                                         "Please use the --solver cadical option.")
+    if args.jobs > 1 and (args.export_cnf or len(args.portfolio) != 0):
+        raise argparse.ArgumentTypeError("Parallel checks cannot be combined with --export-cnf or a portfolio.")
+    if args.jobs > 1 and (args.solver_report or len(args.solver_benchmark) != 0):
+        raise argparse.ArgumentTypeError("The solver report only covers a single process, please use --jobs 1.")
+    if len(args.portfolio) != 0 and len(args.solver_benchmark) != 0:
+        raise argparse.ArgumentTypeError("A portfolio cannot be combined with a solver benchmark.")
+    if "external" in [args.solver] + args.solver_benchmark + args.portfolio and args.solver_bin is None:
+        raise argparse.ArgumentTypeError("The external solver requires the --solver-bin option.")
+    if args.card_encoding in AT_MOST_ONE_ENCODINGS and args.order != 1:
+        raise argparse.ArgumentTypeError("The %s encoding can only be used for order 1." % args.card_encoding)
     if args.kissat_bin_path != None and args.export_cnf == False:
         raise argparse.ArgumentTypeError("Cannot use Kissat without exporting CNF formulas. "
                                          "Please use the --export-cnf option.")
@@ -119,8 +191,7 @@ def parse_arguments():
     return args
 
 
-def generate_labeling(label_file_path, json_module):
-    net_bits, _, _ = helpers.bit_to_net(json_module)
+def generate_labeling(label_file_path, net_bits):
     label_data = ""
     with open(label_file_path, "r") as f:
         label_data = f.read()
@@ -167,26 +238,19 @@ def generate_labeling(label_file_path, json_module):
     return label_dict
 
 
-def generate_ignored(circuit, json_module, ignored_strings):
-    net_bits, _, _ = helpers.bit_to_net(json_module)
-    ignored = set()
-    for fs in ignored_strings:
-        for name in net_bits:
-            if fs not in name: continue
-            for b in net_bits[name]:
-                if type(b) is int:
-                    ignored.add(b)
-
-    for node_id in circuit.nodes:
-        preds = tuple(circuit.predecessors(node_id))
-        if len(preds) == 0: continue
-        if all(map(lambda p: p in ignored, preds)):
-            ignored.add(node_id)
+def generate_ignored(circuit, net_bits, ignored_strings):
+    ignored = IgnoredNodes(circuit, net_bits, ignored_strings)
+    if len(ignored_strings) != 0:
+        print("Ignored %d of %d nodes (%d matched by name)" % (len(ignored), len(circuit), ignored.num_matched))
+    return ignored
 
-    for node_id in ignored:
-        print(circuit.cells[node_id])
 
-    return ignored
+def trace_signals(circuit, args):
+    # only the signals backing the circuit cells, the reset and debug signals are loaded from the trace
+    signals = {circuit.cells[n].name for n in circuit.nodes}
+    signals.add(args.rst_name)
+    signals.update(args.debugs)
+    return signals
 
 
 def vcd_json_sanity_check(trace, circuit_graph, rst_name):
@@ -196,7 +260,7 @@ def vcd_json_sanity_check(trace, circuit_graph, rst_name):
         assert (("const" in graph_node_name) or (graph_node_name in trace.name_to_id)), "%s not recognized"%(graph_node_name)
 
 
-def pretty_error(checker, cycle, cell):
+def pretty_error(checker, cycle, cell, model):
     # from SatChecker.py: SatChecker.__dbg_write_label_trace
     cells = [checker.circuit.cells[x] for x in checker.variables]
     initial = ["%s:%s" % (c.name, c.pos) for c in cells]
@@ -205,7 +269,6 @@ def pretty_error(checker, cycle, cell):
     stable = checker.formula.node_vars_stable[cycle]
     trans = checker.formula.node_vars_trans[cycle] if checker.mode == TRANSIENT else None
     hamming = checker.formula.node_vars_diff[cycle] if checker.hamming else None
-    model = set(checker.formula.solver.get_model())
 
     for node_id in checker.circuit.nodes:
         node_cell = checker.circuit.cells[node_id]
@@ -226,18 +289,16 @@ def pretty_error(checker, cycle, cell):
 def main():
     args = parse_arguments()
 
-    with open(args.json_file_path, "r") as f:
-        circuit_json = json.load(f)
-    circuit_graph = CircuitGraph(circuit_json, args.top_module)
-    safe_graph = SafeGraph(circuit_graph.graph)
+    circuit = load_circuit(args.json_file_path, args.top_module, args.circuit_cache_dir, args.simplify)
+    safe_graph = circuit.safe_graph
 
-    module = circuit_json["modules"][args.top_module]
-    label_dict = generate_labeling(args.label_file_path, module)
-    ignored_set = generate_ignored(safe_graph, module, args.ignored)
-    trace = VCDStorage(args.vcd_file_path)
+    label_dict = generate_labeling(args.label_file_path, circuit.net_bits)
+    ignored_set = generate_ignored(safe_graph, circuit.net_bits, args.ignored)
+    trace = VCDStorage(args.vcd_file_path, args.vcd_index_path, trace_signals(safe_graph, args))
     checker = SatChecker(label_dict, ignored_set, trace, safe_graph, args)
 
     status, locations = checker.check()
+    models = [l[0] for l in locations]
     leaks = [l[1] for l in locations]
     if status and not(args.kissat_bin_path):
         print("The execution is secure")
@@ -252,12 +313,15 @@ def main():
             gates = leaks[i]
             sys.stdout.write("leak %d: " % i)
             for g in gates:
-                cell = circuit_graph.graph.nodes[g.cell_id]["cell"]
+                cell = safe_graph.cells[g.cell_id]
                 sys.stdout.write("(cycle: %d, cell: %s, id: %d) " % (g.cycle, cell, g.cell_id))
+                for n in circuit.merged.get(g.cell_id, []):
+                    # removed cells that always have the same value
+                    sys.stdout.write("(merged: %s, id: %d) " % (circuit.removed_cells[n], n))
             sys.stdout.write("\n")
             for g in gates:
-                cell = circuit_graph.graph.nodes[g.cell_id]["cell"]
-                pretty_error(checker, g.cycle, cell)
+                cell = safe_graph.cells[g.cell_id]
+                pretty_error(checker, g.cycle, cell, models[i])
         sys.exit(INSECURE)
 
 